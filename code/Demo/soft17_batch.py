@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Soft17 - Environment vettorializzato
+Abbatiello Simone
+Nappi Vincenzo
+Niemiec Francesco
+
+Gioca N mani in parallelo con array NumPy, replicando le regole di
+BlackjackEnv (dealer pesca su 17 soft, sta su 17 hard).
+"""
+
+import numpy as np
+
+# Composizione di un seme: asso (11), 2-10, J, Q, K
+SUIT = [11] + list(range(2, 11)) + [10, 10, 10]
+RESHUFFLE_THRESHOLD = 20
+
+# Esiti codificati in step_batch (stessi nomi di info['outcome'] in BlackjackEnv.step)
+OUTCOME_NONE = 0
+OUTCOME_PLAYER_BUST = 1
+OUTCOME_DEALER_BUST = 2
+OUTCOME_PLAYER_WINS = 3
+OUTCOME_DEALER_WINS = 4
+OUTCOME_PUSH = 5
+OUTCOMES = ('', 'player_bust', 'dealer_bust', 'player_wins', 'dealer_wins', 'push')
+
+
+def add_card(total, aces, cards):
+    """Aggiunge una carta per corsia: total è il valore migliore, aces gli assi ancora contati 11"""
+    total += cards
+    aces += (cards == 11)
+    # Una carta singola richiede al massimo due conversioni asso 11 -> 1
+    for _ in range(2):
+        over = (total > 21) & (aces > 0)
+        total -= 10 * over
+        aces -= over
+
+
+class BatchBlackjackEnv:
+    """Environment del Blackjack con num_envs mani parallele e reset automatico"""
+
+    def __init__(self, num_envs=1024, num_decks=8, seed=None, penetration=None, counting=False):
+        # counting è accettato per compatibilità con BlackjackEnv.config(), ma il conteggio
+        # delle carte non è implementato nelle corsie vettoriali
+        if counting:
+            raise ValueError("BatchBlackjackEnv non supporta lo stato esteso (counting)")
+        self.num_envs = num_envs
+        self.num_decks = num_decks
+        self.rng = np.random.default_rng(seed)
+
+        self.base_deck = np.array(SUIT * 4 * num_decks, dtype=np.int8)
+        self.shoe_size = len(self.base_deck)
+        # Carta di taglio, come in Shoe: superata questa posizione la corsia rimescola
+        if penetration is None:
+            self.cut = self.shoe_size - RESHUFFLE_THRESHOLD
+        else:
+            self.cut = int(self.shoe_size * penetration)
+        # Ogni riga contiene sempre le carte di base_deck: mescolare vuol dire solo
+        # permutarla, sul posto e senza array di appoggio più grandi dei sabot
+        self.shoes = np.tile(self.base_deck, (num_envs, 1))
+        self.shoe_ptr = np.zeros(num_envs, dtype=np.int32)
+
+        self.player_total = np.zeros(num_envs, dtype=np.int16)
+        self.player_aces = np.zeros(num_envs, dtype=np.int16)
+        self.dealer_showing = np.zeros(num_envs, dtype=np.int16)
+        self.dealer_hole = np.zeros(num_envs, dtype=np.int16)
+
+        self.rng.permuted(self.shoes, axis=1, out=self.shoes)
+
+    def reshuffle(self, lanes):
+        """Nuovo sabot mescolato per le corsie indicate"""
+        shoes = self.shoes[lanes]
+        self.rng.permuted(shoes, axis=1, out=shoes)
+        self.shoes[lanes] = shoes
+        self.shoe_ptr[lanes] = 0
+
+    def draw_cards(self, lanes):
+        """Pesca una carta per ogni corsia in lanes"""
+        low = lanes[self.shoe_ptr[lanes] > self.cut]
+        if low.size:
+            self.reshuffle(low)
+        ptr = self.shoe_ptr[lanes]
+        cards = self.shoes[lanes, ptr].astype(np.int16)
+        self.shoe_ptr[lanes] = ptr + 1
+        return cards
+
+    def deal(self, lanes):
+        """Distribuisce una nuova mano (stesso ordine di BlackjackEnv.reset)"""
+        first = self.draw_cards(lanes)
+        second = self.draw_cards(lanes)
+        total = np.zeros(len(lanes), dtype=np.int16)
+        aces = np.zeros(len(lanes), dtype=np.int16)
+        add_card(total, aces, first)
+        add_card(total, aces, second)
+        self.player_total[lanes] = total
+        self.player_aces[lanes] = aces
+        self.dealer_showing[lanes] = self.draw_cards(lanes)
+        self.dealer_hole[lanes] = self.draw_cards(lanes)
+
+    def observations(self):
+        """Array (num_envs, 3) con (valore giocatore, soft, carta dealer) come state_to_tuple"""
+        return np.stack([self.player_total,
+                         (self.player_aces > 0).astype(np.int16),
+                         self.dealer_showing], axis=1)
+
+    def reset_batch(self):
+        self.deal(np.arange(self.num_envs))
+        return self.observations()
+
+    def dealer_play(self, lanes):
+        """Gioca il dealer per le corsie indicate e restituisce il valore finale"""
+        total = np.zeros(len(lanes), dtype=np.int16)
+        aces = np.zeros(len(lanes), dtype=np.int16)
+        add_card(total, aces, self.dealer_showing[lanes])
+        add_card(total, aces, self.dealer_hole[lanes])
+        while True:
+            # Pesca sotto 17 e su 17 soft
+            hitting = np.flatnonzero((total < 17) | ((total == 17) & (aces > 0)))
+            if not hitting.size:
+                return total
+            sub_total = total[hitting]
+            sub_aces = aces[hitting]
+            add_card(sub_total, sub_aces, self.draw_cards(lanes[hitting]))
+            total[hitting] = sub_total
+            aces[hitting] = sub_aces
+
+    def step_batch(self, actions):
+        """Esegue un'azione per corsia (0 = STAND, 1 = HIT).
+
+        Restituisce (osservazioni, reward, done, esiti); le corsie terminate
+        vengono ridistribuite subito, quindi le loro osservazioni sono quelle
+        della nuova mano.
+        """
+        actions = np.asarray(actions)
+        rewards = np.zeros(self.num_envs, dtype=np.int8)
+        dones = np.zeros(self.num_envs, dtype=bool)
+        outcomes = np.zeros(self.num_envs, dtype=np.int8)
+
+        hit = np.flatnonzero(actions == 1)
+        if hit.size:
+            total = self.player_total[hit]
+            aces = self.player_aces[hit]
+            add_card(total, aces, self.draw_cards(hit))
+            self.player_total[hit] = total
+            self.player_aces[hit] = aces
+            bust = hit[total > 21]
+            rewards[bust] = -1
+            dones[bust] = True
+            outcomes[bust] = OUTCOME_PLAYER_BUST
+
+        stand = np.flatnonzero(actions == 0)
+        if stand.size:
+            dealer_value = self.dealer_play(stand)
+            player_value = self.player_total[stand]
+            dealer_bust = dealer_value > 21
+            wins = ~dealer_bust & (player_value > dealer_value)
+            losses = ~dealer_bust & (player_value < dealer_value)
+            pushes = ~dealer_bust & (player_value == dealer_value)
+            rewards[stand] = dealer_bust.astype(np.int8) + wins - losses
+            dones[stand] = True
+            outcomes[stand] = (OUTCOME_DEALER_BUST * dealer_bust + OUTCOME_PLAYER_WINS * wins
+                               + OUTCOME_DEALER_WINS * losses + OUTCOME_PUSH * pushes)
+
+        finished = np.flatnonzero(dones)
+        if finished.size:
+            self.deal(finished)
+
+        return self.observations(), rewards, dones, outcomes
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Soft17 - Benchmark
+Abbatiello Simone
+Nappi Vincenzo
+Niemiec Francesco
+
+Suite di benchmark per environment, agenti e training, con RNG fissato e
+risultati in JSON per confrontare esecuzioni diverse:
+
+    python soft17_benchmark.py --json nuovo.json --compare vecchio.json
+"""
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import soft17_demo_qlearning
+from soft17_demo_qlearning import BlackjackEnv, QLearningAgent, encode_state, state_to_tuple
+from soft17_demo_sarsa import SARSAAgent
+from soft17_solver import policy_agreement, solve
+
+# Registro dei benchmark: nome -> funzione(quick) che restituisce un dict di metriche
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def dict_stepper(env):
+    """Un passo per chiamata con reset/step, politica 'pesca sotto 17'"""
+    state = env.reset()
+
+    def step():
+        nonlocal state
+        action = 1 if state['player_value'] < 17 else 0
+        result = env.step(state, action)
+        state = env.reset() if result[2] else result[0]
+        return result, state
+
+    return step
+
+
+def fast_stepper(env):
+    """Un passo per chiamata con reset_fast/step_fast, stessa politica"""
+    obs = env.reset_fast()
+
+    def step():
+        nonlocal obs
+        result = env.step_fast(1 if obs[0] < 17 else 0)
+        obs = env.reset_fast() if result[2] else result[0]
+        return result, obs
+
+    return step
+
+
+def best_time(func, number, repeat=3):
+    """Tempo medio per chiamata, il migliore su repeat ripetizioni"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return best / number
+
+
+def allocations_per_step(step, num_steps):
+    """Blocchi e byte allocati dall'environment per passo.
+
+    I risultati vengono trattenuti, così tracemalloc vede anche gli oggetti
+    che nel training vivrebbero un solo passo (stati, copie delle mani, info).
+    """
+    results = []
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for _ in range(num_steps):
+        results.append(step())
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    only_env = [tracemalloc.Filter(True, soft17_demo_qlearning.__file__)]
+    stats = after.filter_traces(only_env).compare_to(before.filter_traces(only_env), 'filename')
+    blocks = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+    return blocks / num_steps, size / num_steps
+
+
+@benchmark('env_step')
+def bench_env_step(quick):
+    num_steps = 20000 if quick else 200000
+    results = {}
+    for name, make_stepper in (('step', dict_stepper), ('step_fast', fast_stepper)):
+        seconds = best_time(make_stepper(BlackjackEnv()), num_steps)
+        blocks, size = allocations_per_step(make_stepper(BlackjackEnv()), num_steps // 10)
+        results[f'{name}_per_sec'] = 1 / seconds
+        results[f'{name}_blocks'] = blocks
+        results[f'{name}_bytes'] = size
+    return results
+
+
+@benchmark('dealer_play')
+def bench_dealer_play(quick):
+    env = BlackjackEnv()
+    hands = [[env.draw_card(), env.draw_card()] for _ in range(1000)]
+    number = 20 if quick else 200
+    seconds = best_time(lambda: [env.dealer_play(hand.copy()) for hand in hands], number)
+    return {'hands_per_sec': len(hands) / seconds}
+
+
+@benchmark('state_encoding')
+def bench_state_encoding(quick):
+    env = BlackjackEnv()
+    states = [env.reset() for _ in range(1000)]
+    number = 20 if quick else 200
+    tuple_seconds = best_time(lambda: [state_to_tuple(state, env) for state in states], number)
+    index_seconds = best_time(lambda: [encode_state(*state_to_tuple(state, env)) for state in states],
+                              number)
+    return {'state_to_tuple_per_sec': len(states) / tuple_seconds,
+            'encode_state_per_sec': len(states) / index_seconds}
+
+
+@benchmark('q_update')
+def bench_q_update(quick):
+    agent = QLearningAgent()
+    indices = [random.randrange(agent.q_table.shape[0]) for _ in range(1000)]
+    number = 20 if quick else 200
+    seconds = best_time(lambda: [agent.update(s, 1, -0.5) for s in indices], number)
+    return {'update_latency_ns': seconds / len(indices) * 1e9,
+            'q_table_bytes': agent.q_table.nbytes + agent.visits.nbytes}
+
+
+@benchmark('train')
+def bench_train(quick):
+    num_episodes = 20000 if quick else 200000
+    results = {}
+    for name, agent_class in (('qlearning', QLearningAgent), ('sarsa', SARSAAgent)):
+        agent = agent_class(epsilon=0.01)
+        start = time.perf_counter()
+        agent.train(BlackjackEnv(), num_episodes=num_episodes)
+        results[f'{name}_episodes_per_sec'] = num_episodes / (time.perf_counter() - start)
+    return results
+
+
+@benchmark('time_to_quality')
+def bench_time_to_quality(quick, target=0.85, chunk=10000):
+    """Episodi e secondi di training per arrivare a target di accordo con la politica ottima"""
+    max_episodes = 100000 if quick else 1000000
+    results = {'target_agreement': target}
+    for name, agent_class in (('qlearning', QLearningAgent), ('sarsa', SARSAAgent)):
+        agent = agent_class(epsilon=0.01)
+        solution = solve(agent.gamma)
+        env = BlackjackEnv()
+        episodes = 0
+        seconds = 0.0
+        agreement = 0.0
+        while episodes < max_episodes and agreement < target:
+            start = time.perf_counter()
+            agent.train(env, num_episodes=chunk)
+            seconds += time.perf_counter() - start
+            episodes += chunk
+            agreement = policy_agreement(agent, solution=solution)
+        results[f'{name}_episodes'] = episodes
+        results[f'{name}_seconds'] = seconds
+        results[f'{name}_agreement'] = agreement
+    return results
+
+
+def run(names, quick=False, seed=0):
+    results = {}
+    for name in names:
+        # Ogni benchmark riparte dallo stesso seed, indipendentemente da quelli eseguiti prima
+        random.seed(seed)
+        np.random.seed(seed)
+        results[name] = BENCHMARKS[name](quick)
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'seed': seed,
+            'quick': quick,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+
+def print_report(report, baseline=None):
+    for name, metrics in report['results'].items():
+        print(f"\n[{name}]")
+        for metric, value in metrics.items():
+            line = f"  {metric:<30} {value:>16.2f}"
+            old = (baseline or {}).get('results', {}).get(name, {}).get(metric)
+            if old:
+                line += f"   x{value / old:.2f} rispetto al baseline"
+            print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark di Soft17")
+    parser.add_argument('names', nargs='*',
+                        help=f"benchmark da eseguire tra {', '.join(BENCHMARKS)} (default: tutti)")
+    parser.add_argument('--quick', action='store_true', help="meno iterazioni, per un controllo veloce")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', metavar='FILE', help="salva i risultati in FILE")
+    parser.add_argument('--compare', metavar='FILE', help="confronta con i risultati salvati in FILE")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"benchmark sconosciuti: {', '.join(unknown)}")
+
+    report = run(args.names or list(BENCHMARKS), quick=args.quick, seed=args.seed)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
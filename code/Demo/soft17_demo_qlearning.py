@@ -10,39 +10,195 @@ import tkinter as tk
 from tkinter import scrolledtext, messagebox
 from PIL import Image, ImageTk
 import random
+import argparse
+import sys
 import threading
-from collections import defaultdict
+import queue
 import time
+import os
+import json
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
 
 # Percorsi
 UPLOAD_PATH = "pics"
+CACHE_PATH = "cache"
+MODEL_PATH = "models/qlearning.npz"
+
+# Da incrementare se cambiano le regole in step/dealer_play o il formato del modello salvato
+RULES_VERSION = 1
+MODEL_FORMAT_VERSION = 1
+POLICY_FORMAT_VERSION = 1
+RESHUFFLE_THRESHOLD = 20
+# Console: righe massime conservate e intervallo (ms) con cui vengono scritti i messaggi in coda
+CONSOLE_MAX_LINES = 2000
+CONSOLE_POLL_MS = 50
+# Immagini della GUI: chiave -> (file in UPLOAD_PATH, dimensione a cui viene ridimensionato)
+CARD_SIZE = (70, 98)
+TABLE_SIZE = (650, 280)
+SPRITES = {i: (f"{i}.png", CARD_SIZE) for i in range(1, 11)}
+SPRITES.update({11: ("ace.png", CARD_SIZE), 'back': ("card_back.png", CARD_SIZE),
+                'table': ("still.png", TABLE_SIZE)})
+SPRITES.update({name: (f"{name}.png", TABLE_SIZE) for name in ('lock', 'win', 'lose', 'draw')})
+# Pausa (ms) tra le carte scoperte dal dealer dopo STAND
+DEALER_DELAY_MS = 1500
+# Autoplay: pause (ms) a velocità 1x prima della prima mano, tra due decisioni e tra due mani
+FIRST_HAND_DELAY_MS = 3000
+AUTOPLAY_DELAY_MS = 5000
+NEW_HAND_DELAY_MS = 5000
+SPEEDS = (1, 2, 5, 10, 50, 200)
+# Composizione di un seme: asso (11), 2-10, J, Q, K
+SUIT = [11] + list(range(2, 11)) + [10, 10, 10]
+# Stato esteso (counting=True): conteggio Hi-Lo delle carte uscite (2-6: +1, 7-9: 0, 10 e asso: -1),
+# true count arrotondato e limitato a +-TRUE_COUNT_LIMIT, profondità del sabot in DEPTH_BUCKETS fasce
+HI_LO = np.array([0, 0, 1, 1, 1, 1, 1, 0, 0, 0, -1, -1])  # indice = valore della carta
+TRUE_COUNT_LIMIT = 3
+DEPTH_BUCKETS = 3
+# Azioni: la demo usa solo STAND e HIT; con full_actions anche raddoppio, split (fino a
+# MAX_HANDS mani) e resa, ammessa solo come prima decisione (il dealer non controlla il blackjack)
+STAND, HIT, DOUBLE, SPLIT, SURRENDER = range(5)
+ACTION_NAMES = ('STAND', 'HIT', 'DOUBLE', 'SPLIT', 'SURRENDER')
+MAX_HANDS = 4
+# Azioni ammesse per fase della mano: dopo una carta pescata, prime due carte di una mano
+# nata da uno split (senza e con coppia da dividere), mano iniziale (senza e con coppia)
+PHASE_ACTIONS = (
+    (STAND, HIT),
+    (STAND, HIT, DOUBLE),
+    (STAND, HIT, DOUBLE, SPLIT),
+    (STAND, HIT, DOUBLE, SURRENDER),
+    (STAND, HIT, DOUBLE, SPLIT, SURRENDER),
+)
+
+class Shoe:
+    """Sabot a buffer fisso: le carte si leggono con un cursore e si rimescolano sul posto"""
+
+    def __init__(self, num_decks=8, penetration=None, counting=False):
+        self.cards = SUIT * 4 * num_decks
+        self.size = len(self.cards)
+        # Carta di taglio: superata questa posizione il sabot viene rimescolato
+        if penetration is None:
+            self.cut = self.size - RESHUFFLE_THRESHOLD
+        else:
+            self.cut = int(self.size * penetration)
+        # Con counting, offsets[pos] è lo scostamento nella Q-table del bucket di conteggio
+        # prima di pescare la carta pos, ricalcolato a ogni mescolamento
+        self.counting = counting
+        self.offsets = None
+        if counting:
+            positions = np.arange(self.size + 1)
+            # Mazzi ancora da giocare (almeno mezzo, per non far esplodere il true count a fine
+            # sabot) e scostamento della fascia di profondità, uguali per ogni mescolamento
+            self.decks_left = np.maximum((self.size - positions) / 52, 0.5)
+            depth = np.minimum(positions * DEPTH_BUCKETS // (self.cut + 1), DEPTH_BUCKETS - 1)
+            self.depth_offsets = (TRUE_COUNT_LIMIT * DEPTH_BUCKETS + depth) * NUM_STATES
+            self.running = np.zeros(self.size + 1, dtype=np.int64)
+        self.pos = 0
+        self.shuffle()
+
+    def shuffle(self):
+        random.shuffle(self.cards)
+        self.pos = 0
+        if self.counting:
+            self.offsets = self.count_offsets()
+
+    def count_offsets(self):
+        """offsets del sabot appena mescolato (una passata NumPy, non un conto per carta)"""
+        np.cumsum(HI_LO[self.cards], out=self.running[1:])
+        true_count = np.rint(self.running / self.decks_left)
+        np.clip(true_count, -TRUE_COUNT_LIMIT, TRUE_COUNT_LIMIT, out=true_count)
+        return (true_count.astype(np.int64) * (DEPTH_BUCKETS * NUM_STATES) + self.depth_offsets).tolist()
+
+    def hand_offset(self):
+        """Bucket di conteggio per la prossima mano (rimescola se si è oltre la carta di taglio)"""
+        if self.pos > self.cut:
+            self.shuffle()
+        return self.offsets[self.pos]
+
+    def remaining(self):
+        return self.size - self.pos
+
+    def draw(self):
+        if self.pos > self.cut:
+            self.shuffle()
+        card = self.cards[self.pos]
+        self.pos += 1
+        return card
+
+    def draw_many(self, k):
+        """Pesca k carte in blocco, rimescolando prima se supererebbero la carta di taglio"""
+        if k > self.cut + 1:
+            raise ValueError(f"impossibile pescare {k} carte con la carta di taglio a {self.cut}")
+        if self.pos + k - 1 > self.cut:
+            self.shuffle()
+        cards = self.cards[self.pos:self.pos + k]
+        self.pos += k
+        return cards
+
 
 class BlackjackEnv:
     """Environment del Blackjack"""
 
-    def __init__(self, num_decks=8):
+    def __init__(self, num_decks=8, penetration=None, counting=False):
         self.num_decks = num_decks
-        self.reset_deck()
+        self.penetration = penetration
+        self.counting = counting
+        self.shoe = Shoe(num_decks, penetration, counting)
+        # Scostamento di riga nella Q-table del bucket di conteggio della mano in corso,
+        # fissato all'inizio della mano (la carta coperta del dealer non va contata); 0 senza counting
+        self.state_offset = 0
+        # Mani del giocatore per reset_hands/step_hands: carta iniziale, valore, assi contati 11,
+        # puntata, reward (None finché la mano è in gioco) ed esito
+        self.hand_first = [0] * MAX_HANDS
+        self.hand_values = [0] * MAX_HANDS
+        self.hand_aces = [0] * MAX_HANDS
+        self.hand_bets = [1] * MAX_HANDS
+        self.hand_rewards = [None] * MAX_HANDS
+        self.hand_outcomes = [None] * MAX_HANDS
+        self.num_hands = 0
+        self.hand = 0
+
+    def config(self):
+        """Argomenti per ricreare un environment equivalente (es. nei processi worker)"""
+        return {'num_decks': self.num_decks, 'penetration': self.penetration, 'counting': self.counting}
 
     def reset_deck(self):
-        deck = []
-        for _ in range(self.num_decks):
-            for _ in range(4):
-                deck.extend([11] + list(range(2, 11)) + [10, 10, 10])
-        random.shuffle(deck)
-        self.deck = deck
+        self.shoe.shuffle()
 
     def draw_card(self):
-        if len(self.deck) < 20:
-            self.reset_deck()
-        return self.deck.pop()
+        return self.shoe.draw()
 
-    def get_hand_value(self, hand):
+    def rules(self):
+        """Configurazione delle regole, salvata insieme al modello"""
+        return {
+            'version': RULES_VERSION,
+            'num_decks': self.num_decks,
+            'reshuffle_threshold': self.shoe.size - self.shoe.cut,
+            'dealer_hits_soft_17': True,
+        }
+
+    def get_hand_totals(self, hand):
+        """Valore della mano e numero di assi ancora contati 11"""
         value = sum(hand)
         aces = hand.count(11)
         while value > 21 and aces > 0:
             value -= 10
             aces -= 1
+        return value, aces
+
+    def add_card(self, value, aces, card):
+        """Aggiorna in O(1) (valore, assi contati 11) di una mano a cui si aggiunge card"""
+        value += card
+        if card == 11:
+            aces += 1
+        while value > 21 and aces > 0:
+            value -= 10
+            aces -= 1
+        return value, aces
+
+    def get_hand_value(self, hand):
+        value, aces = self.get_hand_totals(hand)
         is_soft = (aces > 0 and value <= 21)
         return value, is_soft
 
@@ -51,40 +207,54 @@ class BlackjackEnv:
         return value > 21
 
     def dealer_play(self, dealer_hand):
+        value, aces = self.get_hand_totals(dealer_hand)
         while True:
-            value, is_soft = self.get_hand_value(dealer_hand)
+            is_soft = aces > 0
             if value > 21:
                 break
             if value >= 17 and not is_soft:
                 break
             if value == 17 and is_soft:
-                dealer_hand.append(self.draw_card())
+                card = self.draw_card()
             elif value < 17:
-                dealer_hand.append(self.draw_card())
+                card = self.draw_card()
             else:
                 break
+            dealer_hand.append(card)
+            value, aces = self.add_card(value, aces, card)
         return dealer_hand
 
     def reset(self):
+        if self.counting:
+            self.state_offset = self.shoe.hand_offset()
         player_hand = [self.draw_card(), self.draw_card()]
         dealer_hand = [self.draw_card(), self.draw_card()]
+        player_value, player_aces = self.get_hand_totals(player_hand)
         return {
             'player_hand': player_hand,
             'dealer_hand': dealer_hand,
-            'dealer_showing': dealer_hand[0]
+            'dealer_showing': dealer_hand[0],
+            # Valore del giocatore e assi contati 11, aggiornati a ogni carta senza riscansionare
+            'player_value': player_value,
+            'player_aces': player_aces
         }
 
     def step(self, state, action):
-        player_hand = state['player_hand'].copy()
-        dealer_hand = state['dealer_hand'].copy()
+        # Si copia solo la mano che cambia, l'altra resta condivisa con lo stato precedente
+        player_hand = state['player_hand']
+        dealer_hand = state['dealer_hand']
         dealer_showing = state['dealer_showing']
+        player_value = state['player_value']
+        player_aces = state['player_aces']
         done = False
         reward = 0
         info = {}
 
         if action == 1:  # HIT
-            player_hand.append(self.draw_card())
-            if self.is_bust(player_hand):
+            card = self.draw_card()
+            player_hand = player_hand + [card]
+            player_value, player_aces = self.add_card(player_value, player_aces, card)
+            if player_value > 21:
                 reward = -1
                 done = True
                 info['outcome'] = 'player_bust'
@@ -92,16 +262,17 @@ class BlackjackEnv:
                 return {
                     'player_hand': player_hand,
                     'dealer_hand': dealer_hand,
-                    'dealer_showing': dealer_showing
+                    'dealer_showing': dealer_showing,
+                    'player_value': player_value,
+                    'player_aces': player_aces
                 }, reward, done, info
 
         elif action == 0:  # STAND
             done = True
-            dealer_hand = self.dealer_play(dealer_hand)
-            player_value, _ = self.get_hand_value(player_hand)
-            dealer_value, _ = self.get_hand_value(dealer_hand)
+            dealer_hand = self.dealer_play(dealer_hand.copy())
+            dealer_value, _ = self.get_hand_totals(dealer_hand)
 
-            if self.is_bust(dealer_hand):
+            if dealer_value > 21:
                 reward = 1
                 info['outcome'] = 'dealer_bust'
             elif player_value > dealer_value:
@@ -117,124 +288,819 @@ class BlackjackEnv:
         return {
             'player_hand': player_hand,
             'dealer_hand': dealer_hand,
-            'dealer_showing': dealer_showing
+            'dealer_showing': dealer_showing,
+            'player_value': player_value,
+            'player_aces': player_aces
         }, reward, done, info
 
 
+    # API snella per il training: la mano resta nell'environment (niente dict né copie)
+    # e le osservazioni sono tuple (valore giocatore, soft, carta dealer) come state_to_tuple
+
+    def reset_fast(self):
+        if self.counting:
+            self.state_offset = self.shoe.hand_offset()
+        draw = self.shoe.draw
+        self.player_value, self.player_aces = self.add_card(0, 0, draw())
+        self.player_value, self.player_aces = self.add_card(self.player_value, self.player_aces, draw())
+        self.dealer_showing = draw()
+        self.dealer_hole = draw()
+        self.outcome = None
+        self.dealer_value = None
+        return (self.player_value, int(self.player_aces > 0), self.dealer_showing)
+
+    def step_fast(self, action):
+        """Come step ma in-place: restituisce (osservazione, reward, done); l'esito resta in
+        self.outcome e, dopo STAND, il valore finale del dealer in self.dealer_value"""
+        if action == 1:  # HIT
+            self.player_value, self.player_aces = self.add_card(self.player_value, self.player_aces,
+                                                                self.shoe.draw())
+            if self.player_value > 21:
+                self.outcome = 'player_bust'
+                return (self.player_value, 0, self.dealer_showing), -1, True
+            return (self.player_value, int(self.player_aces > 0), self.dealer_showing), 0, False
+
+        if action == 0:  # STAND
+            self.dealer_value = dealer_value = self.dealer_total(self.dealer_showing, self.dealer_hole)
+            player_value = self.player_value
+            if dealer_value > 21:
+                reward, self.outcome = 1, 'dealer_bust'
+            elif player_value > dealer_value:
+                reward, self.outcome = 1, 'player_wins'
+            elif player_value < dealer_value:
+                reward, self.outcome = -1, 'dealer_wins'
+            else:
+                reward, self.outcome = 0, 'push'
+            return (player_value, int(self.player_aces > 0), self.dealer_showing), reward, True
+
+        return (self.player_value, int(self.player_aces > 0), self.dealer_showing), 0, False
+
+    def dealer_total(self, upcard, hole):
+        """Valore finale del dealer (stesse regole di dealer_play) senza tenere la lista delle carte"""
+        value, aces = self.add_card(0, 0, upcard)
+        value, aces = self.add_card(value, aces, hole)
+        while value < 17 or (value == 17 and aces > 0):
+            value, aces = self.add_card(value, aces, self.shoe.draw())
+        return value
+
+    # API con tutte le azioni (raddoppio, split, resa): le mani del giocatore stanno nelle
+    # liste hand_* preallocate in __init__ e aggiornate sul posto, self.hand è la mano in
+    # gioco. Le osservazioni sono (valore, soft, carta dealer, fase): la fase indica le
+    # azioni ammesse (PHASE_ACTIONS). Le mani nate da uno split ricevono la seconda carta
+    # quando tocca a loro; gli assi divisi ricevono una sola carta e stanno.
+
+    def reset_hands(self):
+        if self.counting:
+            self.state_offset = self.shoe.hand_offset()
+        draw = self.shoe.draw
+        first, second = draw(), draw()
+        self.dealer_showing = draw()
+        self.dealer_hole = draw()
+        self.outcome = None
+        self.dealer_value = None
+        self.num_hands = 1
+        self.hand = 0
+        self.start_hand(0, first)
+        return self.deal_second(0, second)
+
+    def step_hands(self, action):
+        """Come step_fast per la mano self.hand, con action tra le azioni ammesse dalla fase.
+
+        Restituisce la prossima decisione, che può riguardare un'altra mano; a fine
+        round (done) reward è il totale delle mani, il reward di ciascuna resta in
+        self.hand_rewards e l'esito di ciascuna, separato da '+', in self.outcome.
+        """
+        h = self.hand
+        if action == HIT or action == DOUBLE:
+            value, aces = self.add_card(self.hand_values[h], self.hand_aces[h], self.shoe.draw())
+            self.hand_values[h], self.hand_aces[h] = value, aces
+            if action == DOUBLE:
+                self.hand_bets[h] = 2
+            if value > 21:
+                self.hand_rewards[h] = -self.hand_bets[h]
+                self.hand_outcomes[h] = 'player_bust'
+                return self.next_hand()
+            if action == DOUBLE:
+                return self.next_hand()
+            return (value, int(aces > 0), self.dealer_showing, 0), 0, False
+
+        if action == SPLIT:
+            card = self.hand_first[h]
+            self.start_hand(self.num_hands, card)
+            self.num_hands += 1
+            obs = self.deal_second(h, self.shoe.draw())
+            if card == 11:
+                return self.next_hand()
+            return obs, 0, False
+
+        if action == SURRENDER:
+            self.hand_rewards[h] = -0.5
+            self.hand_outcomes[h] = 'surrender'
+            return self.settle()
+
+        # STAND
+        return self.next_hand()
+
+    def start_hand(self, h, first):
+        self.hand_first[h] = first
+        self.hand_bets[h] = 1
+        self.hand_rewards[h] = None
+
+    def deal_second(self, h, card):
+        """Seconda carta della mano h: osservazione della sua prima decisione"""
+        value, aces = self.add_card(*self.add_card(0, 0, self.hand_first[h]), card)
+        self.hand_values[h], self.hand_aces[h] = value, aces
+        pair = card == self.hand_first[h] and self.num_hands < MAX_HANDS
+        # La resa è ammessa solo sulla mano iniziale, prima di qualunque split
+        phase = (3 if self.num_hands == 1 else 1) + pair
+        return (value, int(aces > 0), self.dealer_showing, phase)
+
+    def next_hand(self):
+        """Passa alla prossima mano da giocare, oppure chiude il round"""
+        while self.hand + 1 < self.num_hands:
+            self.hand += 1
+            obs = self.deal_second(self.hand, self.shoe.draw())
+            if self.hand_first[self.hand] != 11:
+                return obs, 0, False
+        return self.settle()
+
+    def settle(self):
+        """Fine del round: il dealer gioca solo se c'è ancora almeno una mano in gioco"""
+        num_hands = self.num_hands
+        rewards = self.hand_rewards
+        outcomes = self.hand_outcomes
+        if None in rewards[:num_hands]:
+            self.dealer_value = dealer_value = self.dealer_total(self.dealer_showing, self.dealer_hole)
+            for h in range(num_hands):
+                if rewards[h] is not None:
+                    continue
+                value = self.hand_values[h]
+                bet = self.hand_bets[h]
+                if dealer_value > 21:
+                    rewards[h], outcomes[h] = bet, 'dealer_bust'
+                elif value > dealer_value:
+                    rewards[h], outcomes[h] = bet, 'player_wins'
+                elif value < dealer_value:
+                    rewards[h], outcomes[h] = -bet, 'dealer_wins'
+                else:
+                    rewards[h], outcomes[h] = 0, 'push'
+        self.outcome = '+'.join(outcomes[:num_hands])
+        h = self.hand
+        return ((self.hand_values[h], int(self.hand_aces[h] > 0), self.dealer_showing, 0),
+                sum(rewards[:num_hands]), True)
+
+
+def rules_hash(env):
+    rules = json.dumps(env.rules(), sort_keys=True)
+    return hashlib.sha256(rules.encode()).hexdigest()[:16]
+
+
 def state_to_tuple(state, env):
-    player_value, is_soft = env.get_hand_value(state['player_hand'])
-    return (player_value, int(is_soft), state['dealer_showing'])
+    return (state['player_value'], int(state['player_aces'] > 0), state['dealer_showing'])
+
+
+# Spazio degli stati: valore giocatore (0-31) x soft (0/1) x carta dealer (0-11)
+MAX_PLAYER_VALUE = 31
+NUM_STATES = (MAX_PLAYER_VALUE + 1) * 2 * 12
+NUM_ACTIONS = 2
+# Stato esteso: una copia densa degli stati per ogni coppia (true count, profondità)
+NUM_COUNT_BUCKETS = (2 * TRUE_COUNT_LIMIT + 1) * DEPTH_BUCKETS
+# Tutte le azioni: una copia degli stati per fase, con una colonna per azione
+NUM_PHASES = len(PHASE_ACTIONS)
+NUM_FULL_ACTIONS = 5
+
+
+def table_rows(counting=False, full_actions=False):
+    """Righe della Q-table: fasi (se full_actions) dentro ai bucket di conteggio (se counting)"""
+    rows = NUM_STATES * NUM_PHASES if full_actions else NUM_STATES
+    return rows * NUM_COUNT_BUCKETS if counting else rows
+
+
+def encode_state(player_value, is_soft, dealer_showing):
+    """Indice di riga della Q-table per la tripla di state_to_tuple"""
+    return (player_value * 2 + is_soft) * 12 + dealer_showing
+
+
+def encode_full_state(player_value, is_soft, dealer_showing, phase):
+    """Indice di riga per le osservazioni di reset_hands/step_hands"""
+    return phase * NUM_STATES + (player_value * 2 + is_soft) * 12 + dealer_showing
+
+
+def decode_state(index):
+    """Inverso di encode_state"""
+    rest, dealer_showing = divmod(index, 12)
+    player_value, is_soft = divmod(rest, 2)
+    return player_value, is_soft, dealer_showing
+
+
+def state_phase(state):
+    """Fase (PHASE_ACTIONS) di uno stato di reset/step: il round ha una sola mano, quindi
+    sulle prime due carte sono ammessi raddoppio e resa, più lo split con una coppia"""
+    hand = state['player_hand']
+    if len(hand) != 2:
+        return 0
+    return 3 + (hand[0] == hand[1])
+
+
+def state_to_index(state, env, full_actions=False):
+    """Riga della Q-table per uno stato di reset/step; con full_actions nella fase di state_phase"""
+    is_soft = int(state['player_aces'] > 0)
+    if full_actions:
+        return env.state_offset * NUM_PHASES + encode_full_state(
+            state['player_value'], is_soft, state['dealer_showing'], state_phase(state))
+    return env.state_offset + encode_state(state['player_value'], is_soft, state['dealer_showing'])
+
+
+def explain_decision(state, q_values, action):
+    """Testo di get_reasoning: situazione, Q-values e azione scelta"""
+    player_value = state['player_value']
+    is_soft = state['player_aces'] > 0
+    dealer_showing = state['dealer_showing']
+
+    reasoning = []
+    reasoning.append("=" * 50)
+    reasoning.append("ANALISI SITUAZIONE")
+    reasoning.append("=" * 50)
+    reasoning.append(f"Mano giocatore: {state['player_hand']}")
+    reasoning.append(f"Valore: {player_value} ({'soft' if is_soft else 'hard'})")
+    reasoning.append(f"Carta visibile dealer: {dealer_showing}")
+    reasoning.append("")
+
+    if player_value >= 21:
+        reasoning.append("DECISIONE: STAND (valore >= 21)")
+        return "\n".join(reasoning)
+
+    reasoning.append("Q-VALUES")
+    reasoning.append(f"Q(STAND) = {q_values.get(0, 0.0):.4f}")
+    reasoning.append(f"Q(HIT)   = {q_values.get(1, 0.0):.4f}")
+    # Con full_actions q_values contiene anche le altre azioni ammesse
+    for other in (DOUBLE, SPLIT, SURRENDER):
+        if other in q_values:
+            reasoning.append(f"Q({ACTION_NAMES[other]}) = {q_values[other]:.4f}")
+    reasoning.append("")
+
+    reasoning.append("DECISIONE AI")
+    if action == 0:
+        reasoning.append("STAND - Il modello preferisce fermarsi")
+        reasoning.append(f"  Probabilmente il valore {player_value} è sufficiente")
+    elif action == HIT:
+        reasoning.append("HIT - Il modello consiglia di pescare")
+        reasoning.append(f"  Il valore {player_value} è troppo basso")
+    elif action == DOUBLE:
+        reasoning.append("DOUBLE - Il modello consiglia di raddoppiare e pescare una sola carta")
+    elif action == SPLIT:
+        reasoning.append("SPLIT - Il modello consiglia di dividere la coppia")
+    else:
+        reasoning.append("SURRENDER - Il modello consiglia di arrendersi (perde mezza puntata)")
+
+    return "\n".join(reasoning)
+
+
+class StoppingCriteria:
+    """Criteri di arresto del training, controllati a ogni checkpoint.
+
+    q_tolerance: massima variazione assoluta della Q-table tra due checkpoint;
+    stable_checkpoints: numero di checkpoint consecutivi senza cambi dell'azione
+    greedy in nessuno stato; time_budget: secondi di training. I criteri a None
+    sono disattivati.
+
+    Con learning rate costante i Q-value oscillano sempre un po', e negli stati
+    in cui HIT e STAND quasi si equivalgono l'azione greedy continua a cambiare:
+    gli stati con |Q(HIT) - Q(STAND)| < margin non contano per la stabilità.
+    Con il learning rate costante delle demo il rumore non si attenua e qualche
+    stato cambia azione quasi a ogni checkpoint: stable_checkpoints è pensato per
+    schedule in cui i Q-value convergono.
+    """
+
+    def __init__(self, q_tolerance=None, stable_checkpoints=None, time_budget=None, margin=0.0):
+        self.q_tolerance = q_tolerance
+        self.stable_checkpoints = stable_checkpoints
+        self.time_budget = time_budget
+        self.margin = margin
+
+    def start(self, agent):
+        """Da chiamare all'inizio del training"""
+        self.started = time.perf_counter()
+        self.last_q = agent.q_table.copy()
+        self.last_policy, self.last_gap = self.greedy_policy(agent)
+        self.stable = 0
+        self.q_delta = None
+
+    @staticmethod
+    def greedy_policy(agent):
+        """Azione greedy per ogni stato tra quelle già aggiornate (-1 se mai visitato,
+        parità -> STAND) e distanza tra i due Q-value migliori (inf se ne manca uno)"""
+        seen = agent.visits > 0
+        q_values = np.where(seen, agent.q_table, -np.inf)
+        policy = q_values.argmax(axis=1)
+        policy[~seen.any(axis=1)] = -1
+        # Con tutte le azioni (full_actions) si confrontano le due migliori tra quelle provate
+        top = np.sort(q_values, axis=1)
+        with np.errstate(invalid='ignore'):
+            gap = np.where(seen.sum(axis=1) >= 2, top[:, -1] - top[:, -2], np.inf)
+        return policy, gap
+
+    def check(self, agent):
+        """Restituisce il nome del criterio soddisfatto, None se il training deve proseguire"""
+        self.q_delta = float(np.abs(agent.q_table - self.last_q).max())
+        self.last_q[:] = agent.q_table
+        policy, gap = self.greedy_policy(agent)
+        decided = (gap >= self.margin) & (self.last_gap >= self.margin)
+        unchanged = np.all((policy == self.last_policy) | ~decided)
+        self.stable = self.stable + 1 if unchanged else 0
+        self.last_policy, self.last_gap = policy, gap
+
+        if self.q_tolerance is not None and self.q_delta <= self.q_tolerance:
+            return 'q_delta'
+        if self.stable_checkpoints is not None and self.stable >= self.stable_checkpoints:
+            return 'policy_stable'
+        if self.time_budget is not None and time.perf_counter() - self.started >= self.time_budget:
+            return 'time_budget'
+        return None
 
 
 class QLearningAgent:
     """Q-Learning Agent - differenza principale: usa max(Q) invece di Q(s',a') nell'update"""
-    
+    algorithm = 'qlearning'
+
     def __init__(self, learning_rate=0.01, discount_factor=0.95,
-                 epsilon=1.0, epsilon_decay=0.9999, epsilon_min=0.01):
+                 epsilon=1.0, epsilon_decay=0.9999, epsilon_min=0.01, counting=False,
+                 full_actions=False):
         self.lr = learning_rate
         self.gamma = discount_factor
         self.epsilon = epsilon
         self.epsilon_decay = epsilon_decay
         self.epsilon_min = epsilon_min
-        self.q_table = defaultdict(lambda: defaultdict(float))
+        # Q-table densa indicizzata da encode_state (più env.state_offset con counting), o da
+        # encode_full_state con full_actions; visits conta gli update per (stato, azione)
+        self.counting = counting
+        self.full_actions = full_actions
+        shape = (table_rows(counting, full_actions), NUM_FULL_ACTIONS if full_actions else NUM_ACTIONS)
+        self.q_table = np.zeros(shape, dtype=np.float64)
+        self.visits = np.zeros(shape, dtype=np.int64)
+
+    def best_action_index(self, s):
+        """Azione greedy per l'indice di stato s, considerando solo le azioni già aggiornate.
+
+        Sceglie solo tra STAND e HIT: con full_actions confronta queste due colonne (come
+        policy_agreement), per le azioni ammesse nella fase c'è best_legal_action.
+        """
+        seen_stand = self.visits[s, 0] > 0
+        seen_hit = self.visits[s, 1] > 0
+        if seen_stand and seen_hit:
+            q_stand = self.q_table[s, 0]
+            q_hit = self.q_table[s, 1]
+            if q_stand == q_hit:
+                return random.choice([0, 1])
+            return 0 if q_stand > q_hit else 1
+        if seen_stand:
+            return 0
+        if seen_hit:
+            return 1
+        return random.choice([0, 1])
+
+    def max_q(self, s):
+        """max Q(s, a) sulle azioni già aggiornate, 0 se lo stato non è mai stato visitato"""
+        seen_stand = self.visits[s, 0] > 0
+        seen_hit = self.visits[s, 1] > 0
+        if seen_stand and seen_hit:
+            return max(self.q_table[s, 0], self.q_table[s, 1])
+        if seen_stand:
+            return self.q_table[s, 0]
+        if seen_hit:
+            return self.q_table[s, 1]
+        return 0.0
+
+    def best_legal_action(self, s, legal):
+        """best_action_index ristretta alle azioni legal (per full_actions)"""
+        seen = [action for action in legal if self.visits[s, action] > 0]
+        if not seen:
+            return random.choice(legal)
+        q_values = self.q_table[s]
+        best_q = max(q_values[action] for action in seen)
+        best = [action for action in seen if q_values[action] == best_q]
+        return best[0] if len(best) == 1 else random.choice(best)
+
+    def max_legal_q(self, s, legal):
+        """max_q ristretto alle azioni legal"""
+        seen = [self.q_table[s, action] for action in legal if self.visits[s, action] > 0]
+        return max(seen) if seen else 0.0
+
+    def select_full_action(self, s, player_value, phase, training=False):
+        """select_action tra le azioni ammesse nella fase (osservazioni di step_hands)"""
+        if player_value >= 21:
+            return STAND
+        legal = PHASE_ACTIONS[phase]
+        if training and random.random() < self.epsilon:
+            return random.choice(legal)
+        return self.best_legal_action(s, legal)
+
+    def update(self, s, action, target):
+        self.q_table[s, action] += self.lr * (target - self.q_table[s, action])
+        self.visits[s, action] += 1
+
+    def hyperparameters(self):
+        """Argomenti del costruttore, escluso epsilon che evolve durante il training"""
+        return {
+            'learning_rate': self.lr,
+            'discount_factor': self.gamma,
+            'epsilon_decay': self.epsilon_decay,
+            'epsilon_min': self.epsilon_min,
+            'counting': self.counting,
+            'full_actions': self.full_actions,
+        }
+
+    def merge(self, tables):
+        """Unisce le coppie (q_table, visits) dei worker partite da questo agente.
+
+        Ogni Q-value è la media dei valori dei worker pesata sul numero di
+        update che ciascuno ha fatto su quella coppia (stato, azione).
+        """
+        base_visits = self.visits.copy()
+        weighted = np.zeros_like(self.q_table)
+        new_visits = np.zeros_like(self.visits)
+        for q_table, visits in tables:
+            delta = visits - base_visits
+            weighted += delta * q_table
+            new_visits += delta
+        updated = new_visits > 0
+        self.q_table[updated] = weighted[updated] / new_visits[updated]
+        self.visits += new_visits
+
+    def save(self, path, env):
+        """Salva Q-table, contatori, iperparametri, epsilon e regole dell'environment (.npz)"""
+        meta = {
+            'format_version': MODEL_FORMAT_VERSION,
+            'agent': type(self).__name__,
+            'hyperparameters': self.hyperparameters(),
+            'epsilon': self.epsilon,
+            'rules': env.rules(),
+            'rules_hash': rules_hash(env),
+        }
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Scrittura atomica: un'interruzione non lascia un modello corrotto
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, q_table=self.q_table, visits=self.visits, meta=np.array(json.dumps(meta)))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, env):
+        """Carica un modello salvato con save; ValueError se non è compatibile con env"""
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data['meta']))
+            if meta.get('format_version') != MODEL_FORMAT_VERSION:
+                raise ValueError(f"formato modello non supportato: {meta.get('format_version')}")
+            if meta.get('agent') != cls.__name__:
+                raise ValueError(f"il modello appartiene a {meta.get('agent')}, non a {cls.__name__}")
+            if meta.get('rules_hash') != rules_hash(env):
+                raise ValueError("il modello è stato allenato con regole diverse")
+            agent = cls(epsilon=meta['epsilon'], **meta['hyperparameters'])
+            if agent.counting != env.counting:
+                raise ValueError("il modello e l'environment non usano lo stesso stato (counting)")
+            agent.q_table[:] = data['q_table']
+            agent.visits[:] = data['visits']
+        return agent
+
+    def num_states(self):
+        """Numero di stati visitati almeno una volta"""
+        return int(np.count_nonzero(self.visits.any(axis=1)))
+
+    def freeze(self):
+        """Politica greedy attuale come FrozenPolicy (per giocare, non per allenare)"""
+        return FrozenPolicy.from_agent(self)
 
     def get_best_action(self, state, env):
-        state_key = state_to_tuple(state, env)
-        if state_key not in self.q_table:
-            return random.choice([0, 1])
-        q_values = self.q_table[state_key]
-        if not q_values:
-            return random.choice([0, 1])
-        max_q = max(q_values.values())
-        best_actions = [a for a, q in q_values.items() if q == max_q]
-        return random.choice(best_actions)
+        s = state_to_index(state, env, self.full_actions)
+        if self.full_actions:
+            return self.best_legal_action(s, PHASE_ACTIONS[state_phase(state)])
+        return self.best_action_index(s)
 
     def choose_action(self, state, env, training=False):
-        player_value, _ = env.get_hand_value(state['player_hand'])
+        s = state_to_index(state, env, self.full_actions)
+        if self.full_actions:
+            return self.select_full_action(s, state['player_value'], state_phase(state), training)
+        return self.select_action(s, state['player_value'], training)
+
+    def select_action(self, s, player_value, training=False):
+        """choose_action a partire dall'indice di stato"""
         if player_value >= 21:
             return 0
         if training and random.random() < self.epsilon:
             return random.choice([0, 1])
         else:
-            return self.get_best_action(state, env)
+            return self.best_action_index(s)
 
     def get_q_values(self, state, env):
-        state_key = state_to_tuple(state, env)
-        if state_key in self.q_table:
-            return self.q_table[state_key]
-        return {0: 0.0, 1: 0.0}
+        """Q-value delle azioni ammesse nello stato (solo STAND e HIT senza full_actions)"""
+        q_values = self.q_table[state_to_index(state, env, self.full_actions)]
+        legal = PHASE_ACTIONS[state_phase(state)] if self.full_actions else (STAND, HIT)
+        return {action: float(q_values[action]) for action in legal}
 
     def get_reasoning(self, state, env):
-        player_value, is_soft = env.get_hand_value(state['player_hand'])
-        dealer_showing = state['dealer_showing']
-
-        reasoning = []
-        reasoning.append("=" * 50)
-        reasoning.append("ANALISI SITUAZIONE")
-        reasoning.append("=" * 50)
-        reasoning.append(f"Mano giocatore: {state['player_hand']}")
-        reasoning.append(f"Valore: {player_value} ({'soft' if is_soft else 'hard'})")
-        reasoning.append(f"Carta visibile dealer: {dealer_showing}")
-        reasoning.append("")
-
-        if player_value >= 21:
-            reasoning.append("DECISIONE: STAND (valore >= 21)")
-            return "\n".join(reasoning)
-
-        q_values = self.get_q_values(state, env)
-        action = self.get_best_action(state, env)
-
-        reasoning.append("Q-VALUES")
-        reasoning.append(f"Q(STAND) = {q_values.get(0, 0.0):.4f}")
-        reasoning.append(f"Q(HIT)   = {q_values.get(1, 0.0):.4f}")
-        reasoning.append("")
-
-        reasoning.append("DECISIONE AI")
-        if action == 0:
-            reasoning.append("STAND - Il modello preferisce fermarsi")
-            reasoning.append(f"  Probabilmente il valore {player_value} è sufficiente")
-        else:
-            reasoning.append("HIT - Il modello consiglia di pescare")
-            reasoning.append(f"  Il valore {player_value} è troppo basso")
-
-        return "\n".join(reasoning)
-
-    def train(self, env, num_episodes=500000, callback=None):
-        """Training Q-Learning - usa max(Q(s',a)) invece di Q(s',a') come SARSA"""
+        return explain_decision(state, self.get_q_values(state, env), self.get_best_action(state, env))
+
+    def train(self, env, num_episodes=500000, callback=None, stopping=None, check_every=10000,
+              metrics=None):
+        """Training Q-Learning - usa max(Q(s',a)) invece di Q(s',a') come SARSA.
+
+        stopping (StoppingCriteria) viene controllato ogni check_every episodi;
+        restituisce il nome del criterio che ha fermato il training, oppure
+        'num_episodes' se sono stati giocati tutti gli episodi. Con metrics
+        (soft17_metrics.TrainingMetrics) viene registrata una riga per checkpoint.
+        Con full_actions ogni episodio è un round di play_full_episode.
+        """
+        if self.counting != env.counting:
+            raise ValueError("agente ed environment devono avere lo stesso valore di counting")
+        if stopping:
+            stopping.start(self)
+        if metrics:
+            metrics.start(self)
+        reward_sum = 0
         for episode in range(num_episodes):
-            state = env.reset()
-            done = False
-            steps = 0
+            if self.full_actions:
+                reward = self.play_full_episode(env)
+            else:
+                obs = env.reset_fast()
+                done = False
+                steps = 0
+
+                # Il bucket di conteggio resta quello di inizio mano per tutto l'episodio
+                offset = env.state_offset
+                while not done and steps < 50:
+                    state_index = offset + encode_state(*obs)
+                    action = self.select_action(state_index, obs[0], training=True)
+                    obs, reward, done = env.step_fast(action)
+
+                    if done:
+                        # Update terminale
+                        self.update(state_index, action, reward)
+                    else:
+                        # Q-Learning: usa max(Q(s',a)) - differenza chiave con SARSA
+                        max_next_q = self.max_q(offset + encode_state(*obs))
+                        self.update(state_index, action, reward + self.gamma * max_next_q)
+
+                    steps += 1
 
-            while not done and steps < 50:
-                action = self.choose_action(state, env, training=True)
-                next_state, reward, done, info = env.step(state, action)
+            self.epsilon = max(self.epsilon_min, self.epsilon * self.epsilon_decay)
+            # Solo l'ultimo passo dell'episodio ha reward diverso da 0
+            reward_sum += reward
 
-                state_key = state_to_tuple(state, env)
-                current_q = self.q_table[state_key][action]
+            if callback and (episode + 1) % 10000 == 0:
+                callback(episode + 1, num_episodes)
 
-                if done:
-                    # Update terminale
-                    new_q = current_q + self.lr * (reward - current_q)
-                else:
-                    # Q-Learning: usa max(Q(s',a)) - differenza chiave con SARSA
-                    next_state_key = state_to_tuple(next_state, env)
-                    next_q_values = self.q_table[next_state_key]
-                    max_next_q = max(next_q_values.values()) if next_q_values else 0.0
-                    new_q = current_q + self.lr * (reward + self.gamma * max_next_q - current_q)
+            if (episode + 1) % check_every == 0:
+                if metrics:
+                    metrics.record(self, check_every, reward_sum)
+                reward_sum = 0
+                if stopping:
+                    reason = stopping.check(self)
+                    if reason:
+                        return reason
+
+        if metrics and num_episodes % check_every:
+            metrics.record(self, num_episodes % check_every, reward_sum)
+        return 'num_episodes'
+
+    def play_full_episode(self, env):
+        """Un round di training con tutte le azioni (full_actions); restituisce il reward totale.
+
+        Dentro una mano l'update è quello di train; l'ultima azione di ogni mano riceve
+        il reward della mano a fine round, dopo il gioco del dealer, e lo split la somma
+        dei reward di tutte le mani che ne derivano.
+        """
+        obs = env.reset_hands()
+        offset = env.state_offset * NUM_PHASES
+        pending = []  # (mano, stato, azione) in attesa del reward della mano
+        splits = []  # (stato, mani derivate dallo split)
+        done = False
+        while not done:
+            hand = env.hand
+            state_index = offset + encode_full_state(*obs)
+            action = self.select_full_action(state_index, obs[0], obs[3], training=True)
+            obs, reward, done = env.step_hands(action)
+
+            if action == SPLIT:
+                new_hand = env.num_hands - 1
+                for _, hands in splits:
+                    if hand in hands:
+                        hands.append(new_hand)
+                splits.append((state_index, [hand, new_hand]))
+            elif done or env.hand != hand:
+                pending.append((hand, state_index, action))
+            else:
+                max_next_q = self.max_legal_q(offset + encode_full_state(*obs), PHASE_ACTIONS[obs[3]])
+                self.update(state_index, action, self.gamma * max_next_q)
+
+        rewards = env.hand_rewards
+        for hand, state_index, action in pending:
+            self.update(state_index, action, rewards[hand])
+        for state_index, hands in splits:
+            self.update(state_index, SPLIT, sum(rewards[hand] for hand in hands))
+        return reward
+
+    def train_parallel(self, env, num_episodes=500000, callback=None,
+                       num_workers=None, check_every=20000, seed=None, stopping=None,
+                       metrics=None):
+        """Training su più processi a turni di check_every episodi, divisi tra i worker:
+        ognuno allena una copia dell'agente su un proprio environment, poi le copie
+        vengono unite con merge. Dopo ogni turno si aggiornano callback, metriche e
+        criteri di stopping, quindi i checkpoint non dipendono dal numero di worker"""
+        num_workers = num_workers or os.cpu_count() or 1
+        rng = random.Random(seed)
+        # spawn: la GUI chiama il training da un thread, fork non è sicuro
+        context = multiprocessing.get_context('spawn')
+        done = 0
+        if stopping:
+            stopping.start(self)
+        if metrics:
+            metrics.start(self)
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=context) as pool:
+            while done < num_episodes:
+                round_episodes = min(check_every, num_episodes - done)
+                shards = [round_episodes // num_workers + (i < round_episodes % num_workers)
+                          for i in range(num_workers)]
+                params = dict(self.hyperparameters(), epsilon=self.epsilon)
+                futures = [pool.submit(train_shard, type(self), params, self.q_table, self.visits,
+                                       env.config(), shard, rng.getrandbits(64))
+                           for shard in shards if shard]
+                self.merge(future.result() for future in futures)
+
+                done += round_episodes
+                self.epsilon = max(self.epsilon_min,
+                                   self.epsilon * self.epsilon_decay ** round_episodes)
+                if callback:
+                    callback(done, num_episodes)
+                if metrics:
+                    metrics.record(self, round_episodes)
+                if stopping:
+                    reason = stopping.check(self)
+                    if reason:
+                        return reason
+        return 'num_episodes'
+
+
+def train_shard(agent_class, params, q_table, visits, env_config, num_episodes, seed):
+    """Worker di train_parallel: allena una copia dell'agente con un RNG indipendente"""
+    random.seed(seed)
+    env = BlackjackEnv(**env_config)
+    agent = agent_class(**params)
+    agent.q_table[:] = q_table
+    agent.visits[:] = visits
+    agent.train(env, num_episodes=num_episodes)
+    return agent.q_table, agent.visits
+
+
+class FrozenPolicy:
+    """Politica greedy congelata di un agente, per giocare senza Q-table completa.
+
+    actions ha un byte per indice di stato (0 = STAND, 1 = HIT, ...) e q_values i
+    Q-value in float32 per le spiegazioni; entrambi sono in sola lettura. A
+    differenza di get_best_action dell'agente non c'è nulla di casuale: con
+    Q-value in parità, stato mai visitato o valore >= 21 l'azione è STAND.
+    """
+
+    def __init__(self, actions, q_values, agent_name=None):
+        self.actions = bytes(actions)
+        q_values = np.array(q_values, dtype=np.float32).reshape(len(self.actions), -1)
+        q_values.flags.writeable = False
+        self.q_values = q_values
+        self.full_actions = q_values.shape[1] == NUM_FULL_ACTIONS
+        self.counting = len(q_values) == table_rows(True, self.full_actions)
+        self.agent_name = agent_name
+
+    @classmethod
+    def from_agent(cls, agent):
+        # Migliore tra le azioni provate (sempre ammesse nella fase della riga), a parità
+        # quella con indice minore: STAND se è tra queste o se lo stato non è mai stato visitato
+        actions = np.where(agent.visits > 0, agent.q_table, -np.inf).argmax(axis=1)
+        # Riga della Q-table -> valore del giocatore, come in decode_state
+        player_value = np.arange(len(agent.q_table)) % NUM_STATES // 24
+        actions[player_value >= 21] = STAND
+        return cls(actions.astype(np.uint8), agent.q_table, type(agent).__name__)
+
+    def select_action(self, s, player_value=None, training=False):
+        """Stessa firma di select_action dell'agente (player_value è già nella tabella)"""
+        return self.actions[s]
+
+    def select_full_action(self, s, player_value=None, phase=None, training=False):
+        return self.actions[s]
 
-                self.q_table[state_key][action] = new_q
-                state = next_state
-                steps += 1
+    def get_best_action(self, state, env):
+        return self.actions[state_to_index(state, env, self.full_actions)]
 
-            self.epsilon = max(self.epsilon_min, self.epsilon * self.epsilon_decay)
+    def get_q_values(self, state, env):
+        q_values = self.q_values[state_to_index(state, env, self.full_actions)]
+        legal = PHASE_ACTIONS[state_phase(state)] if self.full_actions else (STAND, HIT)
+        return {action: float(q_values[action]) for action in legal}
 
-            if callback and (episode + 1) % 10000 == 0:
-                callback(episode + 1, num_episodes)
+    def get_reasoning(self, state, env):
+        return explain_decision(state, self.get_q_values(state, env), self.get_best_action(state, env))
+
+    def save(self, path, env):
+        """Salva la politica (.npz di pochi KB) con le regole dell'environment"""
+        meta = {
+            'format_version': POLICY_FORMAT_VERSION,
+            'agent': self.agent_name,
+            'rules': env.rules(),
+            'rules_hash': rules_hash(env),
+        }
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, actions=np.frombuffer(self.actions, dtype=np.uint8), q_values=self.q_values,
+                     meta=np.array(json.dumps(meta)))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, env):
+        """Carica una politica salvata con save; ValueError se non è compatibile con env"""
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data['meta']))
+            if meta.get('format_version') != POLICY_FORMAT_VERSION:
+                raise ValueError(f"formato politica non supportato: {meta.get('format_version')}")
+            if meta.get('rules_hash') != rules_hash(env):
+                raise ValueError("la politica è stata calcolata con regole diverse")
+            return cls(data['actions'], data['q_values'], meta.get('agent'))
+
+
+def load_sprite(filename, size):
+    """Immagine di UPLOAD_PATH ridimensionata a size.
+
+    Il risultato viene salvato in CACHE_PATH con nome legato a dimensione e
+    data di modifica del file sorgente, così dal secondo avvio non serve
+    ricampionare nulla finché l'immagine originale non cambia.
+    """
+    source = os.path.join(UPLOAD_PATH, filename)
+    prefix = f"{os.path.splitext(filename)[0]}_{size[0]}x{size[1]}_"
+    cached = os.path.join(CACHE_PATH, f"{prefix}{os.stat(source).st_mtime_ns}.png")
+    try:
+        img = Image.open(cached)
+        img.load()
+        return img
+    except OSError:
+        pass
+
+    with Image.open(source) as original:
+        img = original.resize(size, Image.Resampling.LANCZOS)
+    try:
+        os.makedirs(CACHE_PATH, exist_ok=True)
+        # Versioni in cache di una sorgente ormai modificata
+        for name in os.listdir(CACHE_PATH):
+            if name.startswith(prefix):
+                os.remove(os.path.join(CACHE_PATH, name))
+        tmp_path = f"{cached}.tmp"
+        img.save(tmp_path, format='PNG')
+        os.replace(tmp_path, cached)
+    except OSError:
+        # Senza cache si ricampiona al prossimo avvio
+        pass
+    return img
+
+
+# Motivi di arresto restituiti da train/train_parallel, per la console
+STOP_REASONS = {
+    'num_episodes': "raggiunto il numero massimo di episodi",
+    'q_delta': "Q-table stabile",
+    'policy_stable': "politica stabile",
+    'time_budget': "tempo massimo di training esaurito",
+}
+
+
+def load_or_train(env, log=print):
+    """Carica il modello da MODEL_PATH se compatibile con le regole di env,
+    altrimenti allena un nuovo agente e lo salva; log riceve i messaggi di avanzamento"""
+    try:
+        agent = QLearningAgent.load(MODEL_PATH, env)
+    except FileNotFoundError:
+        log("Nessun modello salvato trovato")
+    except Exception as e:
+        # File troncato (zipfile.BadZipFile), corrotto o di un'altra versione: si riallena
+        log(f"Modello salvato non utilizzabile: {e}")
+    else:
+        log(f"Modello caricato da {MODEL_PATH}")
+        return agent
+
+    log("Training del modello Q-Learning...\n")
+    agent = QLearningAgent(epsilon=0.01)
+    # Al massimo 500000 episodi o 5 minuti
+    stopping = StoppingCriteria(time_budget=300)
+    reason = agent.train_parallel(env, num_episodes=500000, stopping=stopping,
+                                  callback=lambda episode, total: log(f"Progresso training: {episode}/{total}"))
+    log(f"Training terminato: {STOP_REASONS[reason]}")
+    try:
+        agent.save(MODEL_PATH, env)
+    except OSError as e:
+        log(f"Impossibile salvare il modello: {e}")
+    return agent
 
 
 class BlackjackGUI:
-    def __init__(self, root):
+    def __init__(self, root, speed=1):
         self.root = root
         self.root.title("Q-Learning Blackjack - Soft17")
         self.root.geometry("1100x650")
@@ -242,36 +1108,50 @@ class BlackjackGUI:
 
         self.env = BlackjackEnv(num_decks=8)
         self.agent = QLearningAgent(epsilon=0.01)
+        # Decisioni e spiegazioni durante il gioco: politica congelata dopo il training
+        self.policy = self.agent.freeze()
         self.state = None
         self.game_active = False
         self.dealer_revealed = False
         self.show_lock = True
+        # Moltiplicatore della velocità di gioco: divide tutte le pause dell'autoplay
+        self.speed = speed
+        self.dealer_delay_ms = self.delay(DEALER_DELAY_MS)
 
         self.card_images = {}
         self.bg_images = {}
+        # Item dei canvas creati una volta sola e poi aggiornati (vedi draw_table)
+        self.background_item = None
+        self.card_items = {}
+        self.rendered = {}
+        # Le immagini vengono lette (e se serve ridimensionate) in background durante il training;
+        # i PhotoImage si possono creare solo nel thread di Tk, in load_images
+        self.sprite_loader = ThreadPoolExecutor(max_workers=4)
+        self.sprites = {key: self.sprite_loader.submit(load_sprite, *spec) for key, spec in SPRITES.items()}
+        # Messaggi per la console (stringhe) o funzioni da eseguire nel thread di Tk
+        self.log_queue = queue.Queue()
 
         self.create_ui()
+        self.drain_console()
         self.start_training()
 
     def start_training(self):
-        """Avvia il training in un thread separato"""
+        """Carica il modello salvato o lo allena (su più processi) da un thread separato"""
         self.log_to_console("=== BENVENUTO AL BLACKJACK Q-LEARNING ===\n")
         self.log_to_console("Inizializzazione in corso...")
-        self.log_to_console("Training del modello Q-Learning...\n")
-
-        def train_callback(episode, total):
-            self.log_to_console(f"Progresso training: {episode}/{total}")
 
         def do_training():
-            self.agent.train(self.env, num_episodes=500000, callback=train_callback)
-            self.root.after(0, self.training_complete)
+            self.agent = load_or_train(self.env, self.log_to_console)
+            self.policy = self.agent.freeze()
+            # Dal thread di training non si tocca Tk: ci pensa drain_console
+            self.log_queue.put(self.training_complete)
 
         thread = threading.Thread(target=do_training, daemon=True)
         thread.start()
 
     def training_complete(self):
         self.log_to_console("\n✓ Training completato!")
-        self.log_to_console(f"Q-table: {len(self.agent.q_table)} stati")
+        self.log_to_console(f"Q-table: {self.agent.num_states()} stati")
         self.log_to_console("\nRegole: Dealer sta su 17 hard, pesca su 17 soft")
         self.log_to_console("\nIl modello sta giocando automaticamente...")
         self.log_to_console("Osserva come prende le decisioni!\n")
@@ -279,31 +1159,19 @@ class BlackjackGUI:
 
     def load_images(self):
         try:
-            for i in range(1, 11):
-                img = Image.open(f"{UPLOAD_PATH}/{i}.png")
-                img = img.resize((70, 98), Image.Resampling.LANCZOS)
-                self.card_images[i] = ImageTk.PhotoImage(img)
-
-            img = Image.open(f"{UPLOAD_PATH}/ace.png")
-            img = img.resize((70, 98), Image.Resampling.LANCZOS)
-            self.card_images[11] = ImageTk.PhotoImage(img)
-
-            img = Image.open(f"{UPLOAD_PATH}/card_back.png")
-            img = img.resize((70, 98), Image.Resampling.LANCZOS)
-            self.card_back = ImageTk.PhotoImage(img)
-
-            img = Image.open(f"{UPLOAD_PATH}/still.png")
-            img = img.resize((650, 280), Image.Resampling.LANCZOS)
-            self.table_bg = ImageTk.PhotoImage(img)
+            photos = {key: ImageTk.PhotoImage(future.result()) for key, future in self.sprites.items()}
+            self.sprite_loader.shutdown()
 
+            for i in range(1, 12):
+                self.card_images[i] = photos[i]
+            self.card_back = photos['back']
+            self.table_bg = photos['table']
             for name in ['lock', 'win', 'lose', 'draw']:
-                img = Image.open(f"{UPLOAD_PATH}/{name}.png")
-                img = img.resize((650, 280), Image.Resampling.LANCZOS)
-                self.bg_images[name] = ImageTk.PhotoImage(img)
+                self.bg_images[name] = photos[name]
 
             self.show_lock_screen()
             # Avvia automaticamente la prima mano dopo 3 secondi
-            self.root.after(3000, self.new_hand)
+            self.root.after(self.delay(FIRST_HAND_DELAY_MS), self.new_hand)
         except Exception as e:
             self.log_to_console(f"Errore caricamento immagini: {e}")
 
@@ -352,6 +1220,12 @@ class BlackjackGUI:
                                    state=tk.DISABLED, **btn_style)
         self.btn_stand.pack(side=tk.LEFT, padx=8, pady=10)
 
+        self.speed_var = tk.StringVar(value=f"{self.speed:g}x")
+        speed_menu = tk.OptionMenu(control_frame, self.speed_var, *(f"{speed}x" for speed in SPEEDS),
+                                   command=self.set_speed)
+        speed_menu.config(font=('Arial', 12, 'bold'), bg='#1a472a', fg='white', highlightthickness=0)
+        speed_menu.pack(side=tk.LEFT, padx=8, pady=10)
+
         #Q-LEARNING
         console_frame = tk.Frame(main_frame, bg='#1a472a', width=400)
         console_frame.pack(side=tk.RIGHT, fill=tk.BOTH, expand=True)
@@ -367,18 +1241,50 @@ class BlackjackGUI:
         self.console.pack(fill=tk.BOTH, expand=True)
         self.console.config(state=tk.DISABLED)
 
+    def delay(self, ms):
+        return max(1, int(ms / self.speed))
+
+    def set_speed(self, label):
+        """Cambia la velocità dell'autoplay (label come "10x"); vale dalla prossima pausa"""
+        self.speed = float(label.rstrip('x'))
+        self.dealer_delay_ms = self.delay(DEALER_DELAY_MS)
+
     def log_to_console(self, message):
+        """Accoda un messaggio per la console; si può chiamare da qualsiasi thread"""
+        self.log_queue.put(message)
+
+    def drain_console(self):
+        """Scrive in un colpo solo i messaggi accodati, eliminando le righe più vecchie
+        oltre CONSOLE_MAX_LINES; si rischedula ogni CONSOLE_POLL_MS"""
+        lines = []
+        while True:
+            try:
+                item = self.log_queue.get_nowait()
+            except queue.Empty:
+                break
+            if callable(item):
+                self.write_console(lines)
+                lines = []
+                item()
+            else:
+                lines.append(item)
+        self.write_console(lines)
+        self.root.after(CONSOLE_POLL_MS, self.drain_console)
+
+    def write_console(self, lines):
+        if not lines:
+            return
         self.console.config(state=tk.NORMAL)
-        self.console.insert(tk.END, message + "\n")
+        self.console.insert(tk.END, "\n".join(lines) + "\n")
+        excess = int(self.console.index('end-1c').split('.')[0]) - 1 - CONSOLE_MAX_LINES
+        if excess > 0:
+            self.console.delete('1.0', f'{excess + 1}.0')
         self.console.see(tk.END)
         self.console.config(state=tk.DISABLED)
 
     def show_lock_screen(self):
-        self.canvas_image.delete("all")
-        self.canvas_cards.delete("all")
-        if 'lock' in self.bg_images:
-            self.canvas_image.create_image(325, 140,
-                                           image=self.bg_images['lock'], anchor=tk.CENTER)
+        self.set_background(self.bg_images.get('lock'))
+        self.hide_cards()
 
     def new_hand(self):
         if not self.card_images:
@@ -396,24 +1302,37 @@ class BlackjackGUI:
         self.log_to_console("NUOVA MANO INIZIATA")
         self.log_to_console("=" * 50)
         self.draw_table()
-        reasoning = self.agent.get_reasoning(self.state, self.env)
+        reasoning = self.policy.get_reasoning(self.state, self.env)
         self.log_to_console("\n" + reasoning)
         
         # Avvia il gioco automatico dopo 5 secondi per osservare l'analisi
-        self.root.after(5000, self.auto_play)
+        self.root.after(self.delay(AUTOPLAY_DELAY_MS), self.auto_play)
 
     def player_stand(self):
         if not self.game_active:
             return
         self.log_to_console("\n>>> GIOCATORE: STAND <<<")
+        # La mano del giocatore è chiusa: niente altri HIT/STAND durante il turno del dealer
+        self.game_active = False
+        self.btn_stand.config(state=tk.DISABLED)
+        self.btn_hit.config(state=tk.DISABLED)
         self.dealer_revealed = True
         self.draw_table()
-        self.root.update()
-        time.sleep(1.5)
-        self.state, reward, done, info = self.env.step(self.state, 0)
+        final_state, reward, done, info = self.env.step(self.state, 0)
+        self.root.after(self.dealer_delay_ms, self.reveal_dealer, final_state, reward, info, 3)
+
+    def reveal_dealer(self, final_state, reward, info, shown):
+        """Mostra le prime shown carte del dealer e programma la successiva con after,
+        senza bloccare il loop di Tk"""
+        dealer_hand = final_state['dealer_hand']
+        self.state = dict(final_state, dealer_hand=dealer_hand[:shown])
         self.draw_table()
-        self.root.update()
-        time.sleep(1.5)
+        if shown < len(dealer_hand):
+            self.root.after(self.dealer_delay_ms, self.reveal_dealer, final_state, reward, info, shown + 1)
+        else:
+            self.root.after(self.dealer_delay_ms, self.finish_hand, reward, info)
+
+    def finish_hand(self, reward, info):
         self.log_game_result(reward, info)
         self.end_game(reward)
 
@@ -433,7 +1352,7 @@ class BlackjackGUI:
             self.log_game_result(reward, info)
             self.end_game(reward)
         else:
-            reasoning = self.agent.get_reasoning(self.state, self.env)
+            reasoning = self.policy.get_reasoning(self.state, self.env)
             self.log_to_console("\n" + reasoning)
 
     def auto_play(self):
@@ -442,15 +1361,15 @@ class BlackjackGUI:
             return
         
         # Ottieni la decisione del modello
-        action = self.agent.get_best_action(self.state, self.env)
+        action = self.policy.get_best_action(self.state, self.env)
         
         if action == 0:  # STAND
             self.player_stand()
         else:  # HIT
             self.player_hit()
-            # Se il gioco è ancora attivo, continua dopo 5 secondi
+            # Se il gioco è ancora attivo, continua dopo AUTOPLAY_DELAY_MS
             if self.game_active:
-                self.root.after(5000, self.auto_play)
+                self.root.after(self.delay(AUTOPLAY_DELAY_MS), self.auto_play)
 
     def log_game_result(self, reward, info):
         pv, _ = self.env.get_hand_value(self.state['player_hand'])
@@ -473,15 +1392,70 @@ class BlackjackGUI:
         self.btn_start.config(state=tk.DISABLED)
         # RISULTATO
         self.root.after(0, lambda: self.show_result(reward))
-        # Avvia automaticamente una nuova mano dopo 5 secondi
-        self.root.after(5000, self.new_hand)
+        # Avvia automaticamente una nuova mano dopo NEW_HAND_DELAY_MS
+        self.root.after(self.delay(NEW_HAND_DELAY_MS), self.new_hand)
 
     def show_result(self, reward):
         key = 'win' if reward > 0 else ('lose' if reward < 0 else 'draw')
         if key in self.bg_images:
-            self.canvas_image.delete("all")
-            self.canvas_image.create_image(325, 140,
-                                           image=self.bg_images[key], anchor=tk.CENTER)
+            self.set_background(self.bg_images[key])
+
+    def set_background(self, image):
+        """Immagine del canvas superiore (None per svuotarlo), sempre sullo stesso item"""
+        if self.background_item is None:
+            self.background_item = self.canvas_image.create_image(325, 140, anchor=tk.CENTER)
+        self.render_item(self.canvas_image, self.background_item, (325, 140),
+                         image='' if image is None else image,
+                         state=tk.HIDDEN if image is None else tk.NORMAL)
+
+    def render_item(self, canvas, item, coords, **options):
+        """Sposta e riconfigura un item del canvas solo se qualcosa è cambiato dall'ultima volta"""
+        old_coords, old_options = self.rendered.get((canvas, item), (None, {}))
+        if coords != old_coords:
+            canvas.coords(item, *coords)
+        changed = {key: value for key, value in options.items() if old_options.get(key) != value}
+        if changed:
+            canvas.itemconfig(item, **changed)
+        self.rendered[(canvas, item)] = (coords, {**old_options, **options})
+
+    def hide_cards(self):
+        for items in self.card_items.values():
+            for item in items['cards'] + [items['title'], items['value']]:
+                self.render_item(self.canvas_cards, item, self.rendered[(self.canvas_cards, item)][0],
+                                 state=tk.HIDDEN)
+
+    def draw_row(self, row, images, y, title, value=None, value_color='yellow'):
+        """Carte e scritte di una riga del tavolo (dealer o giocatore).
+
+        Gli item del canvas vengono creati la prima volta e poi riusati: le
+        carte in più rispetto alla mano corrente restano nascoste.
+        """
+        cards_width = 650
+        if row not in self.card_items:
+            self.card_items[row] = {
+                'cards': [],
+                'title': self.canvas_cards.create_text(0, y, text=title, font=('Arial', 14, 'bold'),
+                                                       fill='white', anchor=tk.W),
+                'value': self.canvas_cards.create_text(0, y + 25, font=('Arial', 12, 'bold'),
+                                                       anchor=tk.W),
+            }
+        items = self.card_items[row]
+        while len(items['cards']) < len(images):
+            items['cards'].append(self.canvas_cards.create_image(0, y, anchor=tk.CENTER))
+
+        total_width = len(images) * 80
+        start_x = (cards_width - total_width) / 2
+        for i, item in enumerate(items['cards']):
+            if i < len(images):
+                self.render_item(self.canvas_cards, item, (start_x + i * 80 + 35, y),
+                                 image=images[i], state=tk.NORMAL)
+            else:
+                self.render_item(self.canvas_cards, item, (0, y), state=tk.HIDDEN)
+
+        label_x = start_x + total_width + 60
+        self.render_item(self.canvas_cards, items['title'], (label_x, y), state=tk.NORMAL)
+        self.render_item(self.canvas_cards, items['value'], (label_x, y + 25), text=value or '',
+                         fill=value_color, state=tk.NORMAL if value else tk.HIDDEN)
 
     def draw_table(self):
         if self.show_lock:
@@ -489,71 +1463,126 @@ class BlackjackGUI:
             return
 
         # CANVAS TAVOLO
-        self.canvas_image.delete("all")
-        if hasattr(self, 'table_bg'):
-            self.canvas_image.create_image(325, 140,
-                                           image=self.table_bg, anchor=tk.CENTER)
+        self.set_background(getattr(self, 'table_bg', None))
 
         # CANVAS CARTE
-        self.canvas_cards.delete("all")
-
-        # Larghezza canvas carte
-        cards_width = 650
-        cards_height = 250
-
         # AREA DEALER
-        dealer_y = 60
-
-        dealer_hand = self.state['dealer_hand']
-        total_dealer_width = len(dealer_hand) * 80
-        dealer_start_x = (cards_width - total_dealer_width) / 2
-
-        for i, card in enumerate(dealer_hand):
-            x = dealer_start_x + i * 80 + 35
+        dealer_images = []
+        for i, card in enumerate(self.state['dealer_hand']):
             if i == 1 and not self.dealer_revealed:
-                self.canvas_cards.create_image(x, dealer_y, image=self.card_back, anchor=tk.CENTER)
+                dealer_images.append(self.card_back)
             else:
-                img = self.card_images.get(card, self.card_back)
-                self.canvas_cards.create_image(x, dealer_y, image=img, anchor=tk.CENTER)
-
-        dealer_label_x = dealer_start_x + total_dealer_width + 60
-        self.canvas_cards.create_text(dealer_label_x, dealer_y, text="DEALER",
-                                      font=('Arial', 14, 'bold'), fill='white', anchor=tk.W)
-
+                dealer_images.append(self.card_images.get(card, self.card_back))
+        dealer_text = None
         if self.dealer_revealed:
             dv, soft = self.env.get_hand_value(self.state['dealer_hand'])
-            value_text = f"{dv}{' (soft)' if soft else ''}"
-            self.canvas_cards.create_text(dealer_label_x, dealer_y + 25, text=value_text,
-                                          font=('Arial', 12, 'bold'), fill='yellow', anchor=tk.W)
+            dealer_text = f"{dv}{' (soft)' if soft else ''}"
+        self.draw_row('dealer', dealer_images, 60, "DEALER", dealer_text)
 
         # AREA PLAYER
-        player_y = 175
-
-        player_hand = self.state['player_hand']
-        total_player_width = len(player_hand) * 80
-        player_start_x = (cards_width - total_player_width) / 2
-
-        for i, card in enumerate(player_hand):
-            x = player_start_x + i * 80 + 35
-            img = self.card_images.get(card, self.card_back)
-            self.canvas_cards.create_image(x, player_y, image=img, anchor=tk.CENTER)
-
-        player_label_x = player_start_x + total_player_width + 60
-        self.canvas_cards.create_text(player_label_x, player_y, text="GIOCATORE",
-                                      font=('Arial', 14, 'bold'), fill='white', anchor=tk.W)
-
+        player_images = [self.card_images.get(card, self.card_back) for card in self.state['player_hand']]
         pv, soft = self.env.get_hand_value(self.state['player_hand'])
         value_text = f"{pv}{' (soft)' if soft else ''}"
         text_color = 'red' if pv > 21 else 'yellow'
-        self.canvas_cards.create_text(player_label_x, player_y + 25, text=value_text,
-                                      font=('Arial', 12, 'bold'), fill=text_color, anchor=tk.W)
-
+        self.draw_row('player', player_images, 175, "GIOCATORE", value_text, text_color)
+
+def play_headless(policy, env, num_hands, out=sys.stdout, per_hand=False, report_every=100000):
+    """Lo stesso autoplay della GUI (azioni di una FrozenPolicy) senza Tk.
+
+    Con per_hand scrive una riga CSV per mano; ogni report_every mani, e alla
+    fine, una riga di commento con i totali parziali e le mani al secondo.
+    Le politiche con tutte le azioni (full_actions) giocano con step_hands: una
+    mano è un round e vittorie/sconfitte seguono il segno del suo reward totale.
+    Restituisce (vittorie, sconfitte, pareggi).
+    """
+    wins = losses = pushes = 0
+    total = 0
+    if per_hand:
+        out.write("mano,giocatore,dealer,esito,reward\n")
+    actions = policy.actions
+    full_actions = policy.full_actions
+    start = time.perf_counter()
+    for hand in range(1, num_hands + 1):
+        if full_actions:
+            obs = env.reset_hands()
+            offset = env.state_offset * NUM_PHASES
+            done = False
+            while not done:
+                obs, reward, done = env.step_hands(actions[offset + encode_full_state(*obs)])
+        else:
+            obs = env.reset_fast()
+            offset = env.state_offset
+            done = False
+            while not done:
+                obs, reward, done = env.step_fast(actions[offset + encode_state(*obs)])
 
-def main():
-    root = tk.Tk()
-    game = BlackjackGUI(root)
-    root.mainloop()
+        total += reward
+        if reward > 0:
+            wins += 1
+        elif reward < 0:
+            losses += 1
+        else:
+            pushes += 1
+        if per_hand:
+            dealer_value = '' if env.dealer_value is None else env.dealer_value
+            out.write(f"{hand},{obs[0]},{dealer_value},{env.outcome},{reward}\n")
+        if hand % report_every == 0 or hand == num_hands:
+            elapsed = time.perf_counter() - start
+            out.write(f"# mani {hand}  vittorie {wins / hand:.2%}  sconfitte {losses / hand:.2%}  "
+                      f"pareggi {pushes / hand:.2%}  EV {total / hand:+.4f}  "
+                      f"{hand / elapsed:,.0f} mani/s\n")
+            out.flush()
+    return wins, losses, pushes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Soft17 - Q-Learning Demo")
+    parser.add_argument('--speed', type=float, default=1, help="velocità dell'autoplay nella GUI (es. 10)")
+    parser.add_argument('--headless', action='store_true', help="gioca senza interfaccia grafica")
+    parser.add_argument('--hands', type=int, default=1000000, help="mani da giocare in modalità headless")
+    parser.add_argument('--output', metavar='FILE', help="file per i risultati headless (default: stdout)")
+    parser.add_argument('--per-hand', action='store_true', help="scrive anche una riga per ogni mano")
+    parser.add_argument('--report-every', type=int, default=100000, metavar='N',
+                        help="mani tra due righe di totali parziali")
+    parser.add_argument('--seed', type=int, help="seed del mescolamento in modalità headless")
+    parser.add_argument('--policy', metavar='FILE',
+                        help="gioca in modalità headless con una politica esportata, senza modello")
+    parser.add_argument('--export-policy', metavar='FILE',
+                        help="salva la politica congelata del modello in FILE ed esce")
+    args = parser.parse_args(argv)
+    if args.speed <= 0:
+        parser.error("--speed deve essere positivo")
+
+    if not args.headless and not args.export_policy:
+        root = tk.Tk()
+        game = BlackjackGUI(root, speed=args.speed)
+        root.mainloop()
+        return 0
+
+    env = BlackjackEnv(num_decks=8)
+    if args.policy:
+        try:
+            policy = FrozenPolicy.load(args.policy, env)
+        except Exception as e:
+            parser.error(f"politica non utilizzabile: {e}")
+    else:
+        policy = load_or_train(env, log=lambda message: print(message, file=sys.stderr)).freeze()
+    if args.export_policy:
+        policy.save(args.export_policy, env)
+        print(f"Politica salvata in {args.export_policy}", file=sys.stderr)
+        return 0
+    # Sabot nuovo creato dopo il seed, così le mani giocate dipendono solo da --seed
+    random.seed(args.seed)
+    env = BlackjackEnv(num_decks=8, counting=policy.counting)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        play_headless(policy, env, args.hands, out, per_hand=args.per_hand,
+                      report_every=args.report_every)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Soft17 - Valutazione della politica
+Abbatiello Simone
+Nappi Vincenzo
+Niemiec Francesco
+
+Gioca la politica greedy di un agente su molte mani e riporta percentuali di
+vittorie/sconfitte/pareggi, valore atteso per mano e intervallo di confidenza.
+"""
+
+import multiprocessing
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from statistics import NormalDist
+
+import numpy as np
+
+from soft17_batch import BatchBlackjackEnv
+from soft17_demo_qlearning import (NUM_PHASES, NUM_STATES, BlackjackEnv, decode_state, encode_full_state,
+                                   encode_state)
+
+
+def policy_table(agent):
+    """Azione greedy dell'agente per ogni indice di stato (STAND con valore >= 21).
+
+    Gli stati mai visitati o con Q-value in parità ricevono una scelta casuale
+    fissata una volta per tutta la valutazione.
+    """
+    policy = np.zeros(len(agent.q_table), dtype=np.int8)
+    for s in range(len(policy)):
+        player_value, _, _ = decode_state(s % NUM_STATES)
+        policy[s] = agent.select_action(s, player_value)
+    return policy
+
+
+def play_hands(policy, num_hands, env):
+    """Gioca num_hands mani sulle corsie di env: (vittorie, sconfitte, pareggi).
+
+    Si parte da una distribuzione nuova su tutte le corsie e le mani contano
+    nell'ordine in cui vengono distribuite: esaurito il budget, le corsie che
+    finiscono smettono di contare, ma le mani ancora in corso vengono giocate
+    fino alla fine. Fermarsi appena num_hands mani sono finite scarterebbe
+    proprio le mani più lunghe (quelle che pescano), falsando il valore atteso.
+    """
+    wins = losses = pushes = 0
+    obs = env.reset_batch()
+    # Corsie la cui mano in corso fa parte del budget
+    counted = np.zeros(env.num_envs, dtype=bool)
+    counted[:num_hands] = True
+    to_deal = num_hands - int(np.count_nonzero(counted))
+    while True:
+        actions = policy[encode_state(obs[:, 0], obs[:, 1], obs[:, 2])]
+        obs, rewards, dones, _ = env.step_batch(actions)
+        finished = np.flatnonzero(dones & counted)
+        results = rewards[finished]
+        wins += int(np.count_nonzero(results > 0))
+        losses += int(np.count_nonzero(results < 0))
+        pushes += int(np.count_nonzero(results == 0))
+        # Le corsie finite hanno già una mano nuova: conta solo finché resta budget
+        counted[finished[to_deal:]] = False
+        to_deal = max(to_deal - len(finished), 0)
+        if not counted.any():
+            return wins, losses, pushes
+
+
+# Environment di un processo worker di evaluate, creato alla prima chiamata di
+# play_shard e riusato nei blocchi successivi (il pool vive quanto una valutazione)
+worker_env = None
+
+
+def play_shard(policy, num_hands, num_envs, seed, env_config):
+    """Worker per la valutazione multi-processo"""
+    global worker_env
+    if worker_env is None:
+        worker_env = BatchBlackjackEnv(num_envs=num_envs, seed=seed, **env_config)
+    return play_hands(policy, num_hands, worker_env)
+
+
+def summarize(wins, losses, pushes, confidence=0.95, reward_sum=None, reward_squares=None):
+    """Statistiche delle mani giocate; reward_sum e reward_squares (somma dei reward e dei
+    loro quadrati) servono quando i reward non sono solo -1, 0, 1 (full_actions)"""
+    hands = wins + losses + pushes
+    if reward_sum is None:
+        # Reward in {-1, 0, 1}: E[r^2] = P(vittoria) + P(sconfitta)
+        reward_sum, reward_squares = wins - losses, wins + losses
+    ev = reward_sum / hands
+    variance = reward_squares / hands - ev ** 2
+    half_width = NormalDist().inv_cdf((1 + confidence) / 2) * (variance / hands) ** 0.5
+    return {
+        'hands': hands,
+        'win_rate': wins / hands,
+        'loss_rate': losses / hands,
+        'push_rate': pushes / hands,
+        'ev': ev,
+        'ci_low': ev - half_width,
+        'ci_high': ev + half_width,
+        'confidence': confidence,
+    }
+
+
+def scalar_player(agent, env, rng):
+    """Blocchi di mani giocati su BlackjackEnv con le stesse decisioni di get_best_action.
+
+    Con full_actions una mano è un intero round (split compresi) giocato con
+    step_hands; ogni blocco restituisce anche somma e somma dei quadrati dei reward.
+    """
+    def play_block(n):
+        random.seed(rng.getrandbits(64))
+        wins = losses = pushes = 0
+        reward_sum = reward_squares = 0
+        for _ in range(n):
+            if agent.full_actions:
+                obs = env.reset_hands()
+                offset = env.state_offset * NUM_PHASES
+                done = False
+                while not done:
+                    action = agent.select_full_action(offset + encode_full_state(*obs), obs[0], obs[3])
+                    obs, reward, done = env.step_hands(action)
+            else:
+                obs = env.reset_fast()
+                offset = env.state_offset
+                done = False
+                while not done:
+                    action = agent.select_action(offset + encode_state(*obs), obs[0])
+                    obs, reward, done = env.step_fast(action)
+            reward_sum += reward
+            reward_squares += reward * reward
+            if reward > 0:
+                wins += 1
+            elif reward < 0:
+                losses += 1
+            else:
+                pushes += 1
+        return wins, losses, pushes, reward_sum, reward_squares
+    return play_block
+
+
+def with_rewards(wins, losses, pushes):
+    """Risultato di un blocco con reward in {-1, 0, 1}, nel formato di scalar_player"""
+    return wins, losses, pushes, wins - losses, wins + losses
+
+
+def evaluate(agent, num_hands=1000000, env=None, confidence=0.95, target_width=None,
+             num_envs=65536, num_workers=1, check_every=1000000, seed=None, vectorized=True):
+    """Valuta la politica greedy (get_best_action) dell'agente.
+
+    Le mani vengono giocate a blocchi di check_every; se target_width è dato,
+    ci si ferma appena l'intervallo di confidenza è più stretto di target_width.
+    Con vectorized=False si usa BlackjackEnv mano per mano (lento, utile come
+    riferimento); altrimenti BatchBlackjackEnv, su num_workers processi.
+    Gli agenti con stato esteso (counting) o con tutte le azioni (full_actions)
+    vengono sempre valutati mano per mano, perché BatchBlackjackEnv gioca solo
+    HIT/STAND e non tiene il conteggio delle carte.
+    """
+    if num_hands <= 0:
+        raise ValueError(f"num_hands deve essere positivo, non {num_hands}")
+    if check_every <= 0:
+        raise ValueError(f"check_every deve essere positivo, non {check_every}")
+    env = env or BlackjackEnv(counting=agent.counting)
+    if env.counting != agent.counting:
+        raise ValueError("agente ed environment devono avere lo stesso valore di counting")
+    rng = random.Random(seed)
+    wins = losses = pushes = 0
+    reward_sum = reward_squares = 0
+    start = time.perf_counter()
+
+    with ExitStack() as stack:
+        if not vectorized or agent.counting or agent.full_actions:
+            play_block = scalar_player(agent, env, rng)
+        elif num_workers > 1:
+            policy = policy_table(agent)
+            context = multiprocessing.get_context('spawn')
+            pool = stack.enter_context(ProcessPoolExecutor(max_workers=num_workers, mp_context=context))
+            # Corsie per worker: non più delle mani di un blocco diviso tra i worker
+            shard_envs = min(num_envs, -(-min(check_every, num_hands) // num_workers))
+
+            def play_block(n):
+                shards = [n // num_workers + (i < n % num_workers) for i in range(num_workers)]
+                futures = [pool.submit(play_shard, policy, shard, shard_envs, rng.getrandbits(64),
+                                       env.config())
+                           for shard in shards if shard]
+                totals = np.sum([future.result() for future in futures], axis=0)
+                # int(): i totali NumPy renderebbero np.int64/np.float64 i campi del risultato
+                return with_rewards(*(int(total) for total in totals))
+        else:
+            policy = policy_table(agent)
+            batch_env = BatchBlackjackEnv(num_envs=min(num_envs, check_every, num_hands),
+                                          seed=rng.getrandbits(64), **env.config())
+
+            def play_block(n):
+                return with_rewards(*play_hands(policy, n, batch_env))
+
+        while wins + losses + pushes < num_hands:
+            block = min(check_every, num_hands - (wins + losses + pushes))
+            block_wins, block_losses, block_pushes, block_sum, block_squares = play_block(block)
+            wins += int(block_wins)
+            losses += int(block_losses)
+            pushes += int(block_pushes)
+            reward_sum += block_sum
+            reward_squares += block_squares
+            result = summarize(wins, losses, pushes, confidence, reward_sum, reward_squares)
+            if target_width is not None and result['ci_high'] - result['ci_low'] <= target_width:
+                break
+
+    seconds = time.perf_counter() - start
+    result['stopped_early'] = result['hands'] < num_hands
+    result['seconds'] = seconds
+    result['hands_per_sec'] = result['hands'] / seconds
+    return result
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Soft17 - Kernel di training compilati
+Abbatiello Simone
+Nappi Vincenzo
+Niemiec Francesco
+
+Versione compilata con Numba (se installato: pip install numba) del ciclo di
+training di QLearningAgent e SARSAAgent, su indici di stato interi e Q-table
+piatta. Senza Numba le stesse funzioni girano in Python puro; il generatore
+casuale è interno al kernel, quindi a parità di seed i risultati sono
+identici bit per bit nei due casi.
+"""
+
+import random
+
+import numpy as np
+
+from soft17_demo_qlearning import NUM_ACTIONS, NUM_STATES, SUIT, BlackjackEnv
+
+try:
+    import numba
+    from numba import njit
+    COMPILED = not numba.config.DISABLE_JIT
+except ImportError:
+    COMPILED = False
+
+    def njit(*args, **kwargs):
+        """Senza Numba il decoratore lascia la funzione invariata"""
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+QLEARNING = 0
+SARSA = 1
+ALGORITHMS = {'qlearning': QLEARNING, 'sarsa': SARSA}
+M32 = 0xFFFFFFFF
+
+
+@njit(cache=True)
+def next_u32(rng):
+    """xorshift128 su parole a 32 bit: rng è un array di 4 interi, mai tutti nulli"""
+    t = rng[0] ^ ((rng[0] << 11) & M32)
+    rng[0] = rng[1]
+    rng[1] = rng[2]
+    rng[2] = rng[3]
+    w = rng[3]
+    rng[3] = w ^ (w >> 19) ^ t ^ (t >> 8)
+    return rng[3]
+
+
+@njit(cache=True)
+def next_float(rng):
+    return next_u32(rng) / 4294967296.0
+
+
+@njit(cache=True)
+def shuffle(shoe, rng):
+    # Fisher-Yates
+    for i in range(len(shoe) - 1, 0, -1):
+        j = (next_u32(rng) * (i + 1)) >> 32
+        card = shoe[i]
+        shoe[i] = shoe[j]
+        shoe[j] = card
+
+
+@njit(cache=True)
+def add_card(value, aces, card):
+    value += card
+    if card == 11:
+        aces += 1
+    while value > 21 and aces > 0:
+        value -= 10
+        aces -= 1
+    return value, aces
+
+
+@njit(cache=True)
+def best_action(q, visits, s, rng):
+    """Come best_action_index: solo le azioni già aggiornate, parità decisa a caso"""
+    seen_stand = visits[2 * s] > 0
+    seen_hit = visits[2 * s + 1] > 0
+    if seen_stand and seen_hit:
+        if q[2 * s] == q[2 * s + 1]:
+            return next_u32(rng) >> 31
+        return 0 if q[2 * s] > q[2 * s + 1] else 1
+    if seen_stand:
+        return 0
+    if seen_hit:
+        return 1
+    return next_u32(rng) >> 31
+
+
+@njit(cache=True)
+def max_q(q, visits, s):
+    seen_stand = visits[2 * s] > 0
+    seen_hit = visits[2 * s + 1] > 0
+    if seen_stand and seen_hit:
+        return max(q[2 * s], q[2 * s + 1])
+    if seen_stand:
+        return q[2 * s]
+    if seen_hit:
+        return q[2 * s + 1]
+    return 0.0
+
+
+@njit(cache=True)
+def select_action(q, visits, s, player_value, epsilon, rng):
+    if player_value >= 21:
+        return 0
+    if next_float(rng) < epsilon:
+        return next_u32(rng) >> 31
+    return best_action(q, visits, s, rng)
+
+
+@njit(cache=True)
+def train_kernel(q, visits, shoe, pos, cut, rng, num_episodes, algorithm,
+                 lr, gamma, epsilon, epsilon_decay, epsilon_min):
+    """Stesso ciclo di train() dei due agenti; restituisce l'epsilon finale.
+
+    Le carte si pescano come in Shoe.draw (pos è un array di un elemento con il
+    cursore), ma il controllo della carta di taglio è scritto qui nei tre punti
+    in cui si pesca: con Numba una funzione draw che contiene shuffle non viene
+    ottimizzata insieme al ciclo e le sue chiamate costavano circa i due terzi
+    del tempo di training.
+    """
+    initial = [0, 0, 0, 0]
+    for _ in range(num_episodes):
+        for k in range(4):
+            if pos[0] > cut:
+                shuffle(shoe, rng)
+                pos[0] = 0
+            initial[k] = shoe[pos[0]]
+            pos[0] += 1
+        player_value, player_aces = add_card(0, 0, initial[0])
+        player_value, player_aces = add_card(player_value, player_aces, initial[1])
+        dealer_showing = initial[2]
+        dealer_hole = initial[3]
+        # encode_state: (valore * 2 + soft) * 12 + carta dealer
+        s = (player_value * 2 + (player_aces > 0)) * 12 + dealer_showing
+        action = 0
+        if algorithm == SARSA:
+            action = select_action(q, visits, s, player_value, epsilon, rng)
+        done = False
+        steps = 0
+
+        while not done and steps < 50:
+            if algorithm == QLEARNING:
+                action = select_action(q, visits, s, player_value, epsilon, rng)
+
+            reward = 0
+            if action == 1:  # HIT
+                if pos[0] > cut:
+                    shuffle(shoe, rng)
+                    pos[0] = 0
+                card = shoe[pos[0]]
+                pos[0] += 1
+                player_value, player_aces = add_card(player_value, player_aces, card)
+                if player_value > 21:
+                    reward = -1
+                    done = True
+            else:  # STAND
+                done = True
+                dealer_value, dealer_aces = add_card(0, 0, dealer_showing)
+                dealer_value, dealer_aces = add_card(dealer_value, dealer_aces, dealer_hole)
+                while dealer_value < 17 or (dealer_value == 17 and dealer_aces > 0):
+                    if pos[0] > cut:
+                        shuffle(shoe, rng)
+                        pos[0] = 0
+                    card = shoe[pos[0]]
+                    pos[0] += 1
+                    dealer_value, dealer_aces = add_card(dealer_value, dealer_aces, card)
+                if dealer_value > 21 or player_value > dealer_value:
+                    reward = 1
+                elif player_value < dealer_value:
+                    reward = -1
+
+            i = 2 * s + action
+            next_s = s
+            next_action = 0
+            if done:
+                target = float(reward)
+            else:
+                next_s = (player_value * 2 + (player_aces > 0)) * 12 + dealer_showing
+                if algorithm == SARSA:
+                    next_action = select_action(q, visits, next_s, player_value, epsilon, rng)
+                    target = reward + gamma * q[2 * next_s + next_action]
+                else:
+                    target = reward + gamma * max_q(q, visits, next_s)
+            q[i] += lr * (target - q[i])
+            visits[i] += 1
+
+            s = next_s
+            action = next_action
+            steps += 1
+
+        epsilon = max(epsilon_min, epsilon * epsilon_decay)
+    return epsilon
+
+
+def seed_rng(seed):
+    rng = random.Random(seed)
+    words = [rng.getrandbits(32) for _ in range(4)]
+    if not any(words):
+        words[0] = 1
+    return np.array(words, dtype=np.int64)
+
+
+def train_compiled(agent, env=None, num_episodes=500000, callback=None, seed=0, chunk=10000):
+    """Allena agent (QLearningAgent o SARSAAgent) con train_kernel.
+
+    callback(episode, total) viene chiamata ogni chunk episodi, come in train().
+    Lo stato esteso (counting) e le azioni oltre HIT/STAND (full_actions) non sono
+    supportati: quegli agenti si allenano con train.
+    """
+    if agent.counting or agent.full_actions:
+        raise ValueError("train_compiled non supporta gli agenti con counting o full_actions, "
+                         "usare agent.train")
+    env = env or BlackjackEnv()
+    algorithm = ALGORITHMS[agent.algorithm]
+    # Si parte dall'ordine canonico delle carte: il mescolamento dipende solo da seed
+    shoe = np.array(SUIT * 4 * env.num_decks, dtype=np.int64)
+    cut = env.shoe.cut
+    pos = np.array([0], dtype=np.int64)
+    rng = seed_rng(seed)
+    shuffle(shoe, rng)
+
+    q = agent.q_table.reshape(-1)
+    visits = agent.visits.reshape(-1)
+    if not COMPILED:
+        # In Python puro le liste sono molto più veloci degli array NumPy elemento per elemento
+        q, visits, shoe, pos, rng = q.tolist(), visits.tolist(), shoe.tolist(), pos.tolist(), rng.tolist()
+
+    done = 0
+    while done < num_episodes:
+        n = min(chunk, num_episodes - done)
+        agent.epsilon = train_kernel(q, visits, shoe, pos, cut, rng, n, algorithm,
+                                     agent.lr, agent.gamma, agent.epsilon,
+                                     agent.epsilon_decay, agent.epsilon_min)
+        done += n
+        if callback:
+            callback(done, num_episodes)
+
+    if not COMPILED:
+        agent.q_table[:] = np.array(q).reshape(NUM_STATES, NUM_ACTIONS)
+        agent.visits[:] = np.array(visits).reshape(NUM_STATES, NUM_ACTIONS)
+    return agent
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Soft17 - Metriche di training
+Abbatiello Simone
+Nappi Vincenzo
+Niemiec Francesco
+
+Raccolta di metriche durante train()/train_parallel() degli agenti, con
+esportazione in CSV, JSON o formato testuale Prometheus:
+
+    metrics = TrainingMetrics()
+    with profile_phases(agent, env, metrics):
+        agent.train(env, num_episodes=200000, metrics=metrics)
+    metrics.to_csv("metrics.csv")
+
+Con metrics il training fa solo un controllo ogni check_every episodi, quindi
+il costo è trascurabile; profile_phases invece misura il tempo delle singole
+fasi sostituendo temporaneamente i metodi con versioni cronometrate, ed è
+più invasivo (il training rallenta di circa 1.5x).
+"""
+
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Fasi misurate da profile_phases
+PHASES = ('env_step', 'encode', 'select', 'update')
+FIELDS = ('episode', 'seconds', 'episodes_per_sec', 'steps_per_sec', 'mean_reward',
+          'epsilon', 'q_states') + tuple(f'{phase}_seconds' for phase in PHASES)
+
+
+class TrainingMetrics:
+    """Serie temporale di metriche, una riga per checkpoint del training.
+
+    mean_reward è la media del reward finale per episodio sugli ultimi window
+    checkpoint (non disponibile con train_parallel); i tempi per fase sono
+    relativi all'intervallo tra due checkpoint.
+    """
+
+    def __init__(self, window=10):
+        self.rows = []
+        self.rewards = deque(maxlen=window)
+        self.phase_seconds = dict.fromkeys(PHASES, 0.0)
+        self.episodes = 0
+        self.started = None
+
+    def start(self, agent):
+        """Chiamata da train all'inizio; un secondo training prosegue la stessa serie"""
+        now = time.perf_counter()
+        if self.started is None:
+            self.started = now
+        self.last_time = now
+        self.last_steps = int(agent.visits.sum())
+        self.last_phases = dict(self.phase_seconds)
+
+    def record(self, agent, episodes, reward_sum=None):
+        """Aggiunge una riga: episodes episodi giocati dall'ultima chiamata, con reward totale reward_sum"""
+        now = time.perf_counter()
+        elapsed = max(now - self.last_time, 1e-9)
+        # Ogni passo di training fa esattamente un update, anche dopo merge
+        steps = int(agent.visits.sum())
+        self.episodes += episodes
+        if reward_sum is not None:
+            self.rewards.append((episodes, reward_sum))
+
+        row = {
+            'episode': self.episodes,
+            'seconds': now - self.started,
+            'episodes_per_sec': episodes / elapsed,
+            'steps_per_sec': (steps - self.last_steps) / elapsed,
+            'mean_reward': (sum(r for _, r in self.rewards) / sum(e for e, _ in self.rewards)
+                            if self.rewards else None),
+            'epsilon': agent.epsilon,
+            'q_states': agent.num_states(),
+        }
+        for phase in PHASES:
+            row[f'{phase}_seconds'] = self.phase_seconds[phase] - self.last_phases[phase]
+        self.rows.append(row)
+
+        self.last_time = now
+        self.last_steps = steps
+        self.last_phases = dict(self.phase_seconds)
+        return row
+
+    def to_csv(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+    def to_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.rows, f, indent=2)
+
+    def to_prometheus(self, path, labels=None):
+        """Ultimo checkpoint in formato testuale Prometheus (per il textfile collector)"""
+        if not self.rows:
+            return
+        label_text = ",".join(f'{key}="{value}"' for key, value in (labels or {}).items())
+        label_text = f"{{{label_text}}}" if label_text else ""
+        lines = []
+        for field, value in self.rows[-1].items():
+            if value is None:
+                continue
+            name = f"soft17_training_{field}"
+            lines.append(f"# TYPE {name} {'counter' if field == 'episode' else 'gauge'}")
+            lines.append(f"{name}{label_text} {value}")
+        # Scrittura atomica: il collector non deve mai leggere un file a metà
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+
+def timed(func, totals, phase):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        totals[phase] += time.perf_counter() - start
+        return result
+    return wrapper
+
+
+@contextmanager
+def profile_phases(agent, env, metrics):
+    """Cronometra le fasi del training (solo train, non train_parallel).
+
+    env_step: reset_fast/step_fast; encode: encode_state; select: select_action;
+    update: max_q e update. I metodi vengono sostituiti sulle istanze di agent
+    ed env, encode_state nel modulo dell'agente; all'uscita si torna agli originali.
+    """
+    totals = metrics.phase_seconds
+    module = sys.modules[type(agent).__module__]
+    encode_state = module.encode_state
+    patched = ((env, 'reset_fast', 'env_step'), (env, 'step_fast', 'env_step'),
+               (agent, 'select_action', 'select'), (agent, 'max_q', 'update'),
+               (agent, 'update', 'update'))
+    for obj, name, phase in patched:
+        setattr(obj, name, timed(getattr(obj, name), totals, phase))
+    module.encode_state = timed(encode_state, totals, 'encode')
+    try:
+        yield metrics
+    finally:
+        module.encode_state = encode_state
+        for obj, name, _ in patched:
+            delattr(obj, name)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Soft17 - Soluzione esatta con programmazione dinamica
+Abbatiello Simone
+Nappi Vincenzo
+Niemiec Francesco
+
+Calcola i Q-value ottimi (solo HIT/STAND) per le regole di BlackjackEnv,
+approssimando il sabot da 8 mazzi con un mazzo infinito.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+from soft17_demo_qlearning import NUM_ACTIONS, NUM_STATES, encode_state
+
+# Probabilità di ogni valore di carta con mazzo infinito (10, J, Q, K valgono 10)
+CARD_PROBS = {card: (4 if card == 10 else 1) / 13 for card in range(2, 12)}
+# Esiti finali del dealer: 17, 18, 19, 20, 21, sballato
+DEALER_FINALS = (17, 18, 19, 20, 21)
+DEALER_BUST = len(DEALER_FINALS)
+
+
+def add_card_value(total, is_soft, card):
+    """Valore (totale, soft) dopo aver aggiunto card a una mano"""
+    total += card
+    aces = int(is_soft) + (card == 11)
+    while total > 21 and aces > 0:
+        total -= 10
+        aces -= 1
+    return total, aces > 0
+
+
+@lru_cache(maxsize=None)
+def dealer_final_from(total, is_soft):
+    """Distribuzione del totale finale del dealer partendo da (total, is_soft)"""
+    dist = np.zeros(len(DEALER_FINALS) + 1)
+    if total > 21:
+        dist[DEALER_BUST] = 1.0
+        return dist
+    # Stesse regole di dealer_play: sta su 17 hard, pesca su 17 soft
+    if total > 17 or (total == 17 and not is_soft):
+        dist[total - 17] = 1.0
+        return dist
+    for card, prob in CARD_PROBS.items():
+        dist += prob * dealer_final_from(*add_card_value(total, is_soft, card))
+    return dist
+
+
+def dealer_distribution(upcard):
+    """Distribuzione del totale finale del dealer data la carta visibile"""
+    return dealer_final_from(upcard, upcard == 11)
+
+
+def stand_value(player_value, upcard):
+    """Reward atteso di STAND, con gli stessi esiti di BlackjackEnv.step"""
+    dist = dealer_distribution(upcard)
+    value = dist[DEALER_BUST]
+    for i, dealer_value in enumerate(DEALER_FINALS):
+        if player_value > dealer_value:
+            value += dist[i]
+        elif player_value < dealer_value:
+            value -= dist[i]
+    return value
+
+
+def player_states():
+    """Stati raggiungibili (valore, soft, carta dealer) con valore <= 21"""
+    for dealer_showing in range(2, 12):
+        for player_value in range(4, 22):
+            yield player_value, 0, dealer_showing
+        for player_value in range(12, 22):
+            yield player_value, 1, dealer_showing
+
+
+def solve(discount_factor=1.0, tol=1e-12, max_sweeps=100):
+    """Value iteration sullo spazio di state_to_tuple.
+
+    Restituisce (q_table, valid): q_table ha lo stesso layout di
+    QLearningAgent.q_table, valid indica le coppie (stato, azione) ammesse
+    (con valore >= 21 l'agente sta sempre).
+    """
+    q_table = np.zeros((NUM_STATES, NUM_ACTIONS))
+    valid = np.zeros((NUM_STATES, NUM_ACTIONS), dtype=bool)
+    states = list(player_states())
+    for player_value, is_soft, dealer_showing in states:
+        s = encode_state(player_value, is_soft, dealer_showing)
+        q_table[s, 0] = stand_value(player_value, dealer_showing)
+        valid[s, 0] = True
+        valid[s, 1] = player_value < 21
+
+    def state_value(s):
+        return q_table[s].max() if valid[s, 1] else q_table[s, 0]
+
+    for _ in range(max_sweeps):
+        delta = 0.0
+        for player_value, is_soft, dealer_showing in states:
+            s = encode_state(player_value, is_soft, dealer_showing)
+            if not valid[s, 1]:
+                continue
+            hit_value = 0.0
+            for card, prob in CARD_PROBS.items():
+                next_value, next_soft = add_card_value(player_value, is_soft, card)
+                if next_value > 21:
+                    hit_value -= prob
+                else:
+                    next_s = encode_state(next_value, int(next_soft), dealer_showing)
+                    hit_value += prob * discount_factor * state_value(next_s)
+            delta = max(delta, abs(hit_value - q_table[s, 1]))
+            q_table[s, 1] = hit_value
+        if delta < tol:
+            break
+    return q_table, valid
+
+
+def load_solution(agent, discount_factor=None):
+    """Carica la soluzione esatta in un QLearningAgent/SARSAAgent (di default con il suo gamma)"""
+    if discount_factor is None:
+        discount_factor = agent.gamma
+    q_table, valid = solve(discount_factor)
+    # Con lo stato esteso (counting) o tutte le azioni (full_actions) la stessa soluzione va
+    # in ogni bucket di conteggio e in ogni fase, nelle colonne di STAND e HIT
+    columns = agent.q_table.shape[1]
+    agent.q_table.reshape(-1, NUM_STATES, columns)[:, :, :NUM_ACTIONS] = q_table
+    agent.visits.reshape(-1, NUM_STATES, columns)[:, :, :NUM_ACTIONS] = valid
+    return agent
+
+
+def policy_agreement(agent, discount_factor=None, solution=None):
+    """Frazione degli stati in cui l'azione greedy dell'agente coincide con quella ottima.
+
+    solution è un risultato di solve già calcolato, utile per misure ripetute.
+    """
+    if solution is None:
+        solution = solve(agent.gamma if discount_factor is None else discount_factor)
+    q_table, valid = solution
+    # Con lo stato esteso (counting) o tutte le azioni (full_actions) si confrontano gli stati
+    # di tutti i bucket e di tutte le fasi, sulla sola scelta tra HIT e STAND
+    buckets = len(agent.q_table) // NUM_STATES
+    q_table, valid = np.tile(q_table, (buckets, 1)), np.tile(valid, (buckets, 1))
+    decisions = np.flatnonzero(valid[:, 1])
+    optimal = q_table[decisions].argmax(axis=1)
+    learned = np.array([agent.best_action_index(s) for s in decisions])
+    return float(np.mean(learned == optimal))
+
+
+def main():
+    q_table, valid = solve()
+    print("Strategia ottima (H = HIT, S = STAND)")
+    for is_soft, label in ((0, "hard"), (1, "soft")):
+        print(f"\n{label:>8} " + " ".join(f"{d:>2}" for d in range(2, 12)))
+        for player_value in range(12 if is_soft else 4, 21):
+            row = []
+            for dealer_showing in range(2, 12):
+                s = encode_state(player_value, is_soft, dealer_showing)
+                row.append(" H" if q_table[s, 1] > q_table[s, 0] else " S")
+            print(f"{player_value:>8} " + " ".join(row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Soft17 - Ricerca degli iperparametri
+Abbatiello Simone
+Nappi Vincenzo
+Niemiec Francesco
+
+Grid search o random search sugli argomenti del costruttore di QLearningAgent
+e SARSAAgent e sul numero di episodi di training. Le prove girano in parallelo
+su un pool di processi, ogni politica viene valutata sulle stesse mani (seed
+di valutazione fisso) e alla fine si ottiene una tabella ordinata per valore
+atteso:
+
+    python soft17_sweep.py --agent qlearning sarsa --learning-rate 0.01 0.05 \\
+        --epsilon 1.0 0.1 --episodes 100000 --checkpoint sweep.jsonl --table sweep.csv
+
+Ogni prova completata viene aggiunta subito al file di checkpoint: rilanciando
+lo stesso comando dopo un'interruzione si riparte dalle prove mancanti.
+"""
+
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from soft17_demo_qlearning import BlackjackEnv, QLearningAgent
+from soft17_demo_sarsa import SARSAAgent
+from soft17_evaluate import evaluate
+from soft17_solver import policy_agreement
+
+AGENTS = {'qlearning': QLearningAgent, 'sarsa': SARSAAgent}
+PARAMETERS = ('learning_rate', 'discount_factor', 'epsilon', 'epsilon_decay', 'epsilon_min')
+
+# Spazio di default: una lista di valori per chiave; nella random search una
+# tupla (minimo, massimo) indica un intervallo continuo
+DEFAULT_SPACE = {
+    'agent': ['qlearning', 'sarsa'],
+    'learning_rate': [0.01, 0.05, 0.1],
+    'discount_factor': [0.95, 1.0],
+    'epsilon': [1.0, 0.1, 0.01],
+    'epsilon_decay': [0.9999],
+    'epsilon_min': [0.01],
+    'episodes': [100000],
+}
+FIELDS = ('rank', 'trial', 'agent') + PARAMETERS + ('counting', 'full_actions') + (
+    'episodes', 'ev', 'ci_low', 'ci_high', 'win_rate', 'loss_rate', 'push_rate',
+    'agreement', 'train_seconds', 'eval_seconds', 'seed')
+
+
+def grid(space):
+    """Tutte le combinazioni dei valori di space"""
+    keys = list(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[key] for key in keys))]
+
+
+def random_search(space, num_trials, seed=0):
+    """num_trials configurazioni estratte da space (liste: scelta, tuple: uniforme)"""
+    rng = random.Random(seed)
+    configs = []
+    for _ in range(num_trials):
+        config = {}
+        for key, values in space.items():
+            config[key] = rng.uniform(*values) if isinstance(values, tuple) else rng.choice(values)
+        configs.append(config)
+    return configs
+
+
+def trial_id(config, eval_hands, eval_seed, seed):
+    """Identificativo stabile di una prova: cambia se cambia la configurazione o la valutazione"""
+    key = json.dumps({'config': config, 'eval_hands': eval_hands, 'eval_seed': eval_seed,
+                      'seed': seed}, sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()[:12]
+
+
+def run_trial(config, seed, eval_hands, eval_seed):
+    """Worker: allena un agente con config e ne valuta la politica greedy"""
+    random.seed(seed)
+    # L'environment va creato dopo il seed: il primo mescolamento usa random
+    counting = config.get('counting', False)
+    env = BlackjackEnv(counting=counting)
+    agent = AGENTS[config['agent']](counting=counting, full_actions=config.get('full_actions', False),
+                                    **{key: config[key] for key in PARAMETERS if key in config})
+    row = dict(agent=config['agent'], epsilon=agent.epsilon, **agent.hyperparameters())
+
+    start = time.perf_counter()
+    agent.train(env, num_episodes=config['episodes'])
+    train_seconds = time.perf_counter() - start
+    # Stesso eval_seed per tutte le prove: ogni politica gioca le stesse mani, su un
+    # environment nuovo (il sabot di training dipende dalla prova) mescolato da eval_seed
+    random.seed(eval_seed)
+    eval_env = BlackjackEnv(counting=counting)
+    result = evaluate(agent, num_hands=eval_hands, env=eval_env, seed=eval_seed,
+                      num_envs=min(1024, eval_hands), check_every=eval_hands)
+
+    row.update({
+        'episodes': config['episodes'],
+        'ev': result['ev'],
+        'ci_low': result['ci_low'],
+        'ci_high': result['ci_high'],
+        'win_rate': result['win_rate'],
+        'loss_rate': result['loss_rate'],
+        'push_rate': result['push_rate'],
+        'agreement': policy_agreement(agent),
+        'train_seconds': train_seconds,
+        'eval_seconds': result['seconds'],
+        'seed': seed,
+    })
+    return row
+
+
+def load_checkpoint(path):
+    """Prove già completate nel file di checkpoint, per identificativo"""
+    done = {}
+    if not path or not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                # Ultima riga troncata da un'interruzione: la prova verrà ripetuta
+                continue
+            done[row['trial']] = row
+    return done
+
+
+def rank(rows, key='ev'):
+    """Righe ordinate per key decrescente, con la posizione in 'rank'"""
+    ranked = sorted(rows, key=lambda row: (-row[key], -row['ci_low'], row['trial']))
+    return [dict(row, rank=i + 1) for i, row in enumerate(ranked)]
+
+
+def sweep(configs, eval_hands=200000, eval_seed=0, seed=0, num_workers=None,
+          checkpoint=None, log=print):
+    """Esegue le prove di configs (saltando quelle già nel checkpoint) e restituisce la classifica"""
+    num_workers = num_workers or os.cpu_count() or 1
+    done = load_checkpoint(checkpoint)
+    if done:
+        # Riscrive il checkpoint senza l'eventuale riga troncata, così le
+        # prossime righe vengono aggiunte su una riga nuova
+        tmp_path = f"{checkpoint}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.writelines(json.dumps(row) + "\n" for row in done.values())
+        os.replace(tmp_path, checkpoint)
+    # Configurazioni ripetute (possibili nella random search) contano una volta sola
+    trials = {trial_id(config, eval_hands, eval_seed, seed): config for config in configs}
+    rows = [done[trial] for trial in trials if trial in done]
+    pending = {trial: config for trial, config in trials.items() if trial not in done}
+    log(f"{len(trials)} prove: {len(rows)} già completate, {len(pending)} da eseguire")
+
+    if pending:
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=context) as pool:
+            # Il seed di training dipende solo dalla prova, non dall'ordine di esecuzione
+            futures = {pool.submit(run_trial, config, int(trial, 16), eval_hands, eval_seed): trial
+                       for trial, config in pending.items()}
+            for future in as_completed(futures):
+                row = dict(future.result(), trial=futures[future])
+                rows.append(row)
+                if checkpoint:
+                    with open(checkpoint, 'a') as f:
+                        f.write(json.dumps(row) + "\n")
+                log(f"[{len(rows)}/{len(trials)}] {row['trial']} {row['agent']} "
+                    f"ev={row['ev']:+.4f} accordo={row['agreement']:.3f}")
+    return rank(rows)
+
+
+def write_table(rows, path):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def print_table(rows, top=20):
+    print(f"\n{'#':>3} {'agente':<10} {'lr':>7} {'gamma':>6} {'eps':>6} {'decay':>8} {'eps_min':>7} "
+          f"{'episodi':>9} {'ev':>8} {'IC 95%':>19} {'accordo':>8}")
+    for row in rows[:top]:
+        print(f"{row['rank']:>3} {row['agent']:<10} {row['learning_rate']:>7.4g} "
+              f"{row['discount_factor']:>6.4g} {row['epsilon']:>6.4g} {row['epsilon_decay']:>8.6g} "
+              f"{row['epsilon_min']:>7.4g} {row['episodes']:>9} {row['ev']:>+8.4f} "
+              f"[{row['ci_low']:+.4f}, {row['ci_high']:+.4f}] {row['agreement']:>8.3f}")
+
+
+def parse_values(values, cast):
+    """Valori da riga di comando: 'a:b' è un intervallo continuo (solo random search)"""
+    if len(values) == 1 and ':' in values[0]:
+        low, high = values[0].split(':')
+        return (cast(low), cast(high))
+    return [cast(value) for value in values]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ricerca degli iperparametri di Soft17")
+    parser.add_argument('--agent', nargs='+', choices=list(AGENTS), default=DEFAULT_SPACE['agent'])
+    for name in PARAMETERS:
+        parser.add_argument(f"--{name.replace('_', '-')}", nargs='+', metavar='VALORE',
+                            default=[str(value) for value in DEFAULT_SPACE[name]],
+                            help="valori da provare, oppure MIN:MAX con --random")
+    parser.add_argument('--episodes', nargs='+', type=int, default=DEFAULT_SPACE['episodes'])
+    parser.add_argument('--counting', action='store_true',
+                        help="agenti con stato esteso (conteggio delle carte e profondità del sabot)")
+    parser.add_argument('--full-actions', action='store_true',
+                        help="agenti con raddoppio, split e resa oltre a HIT/STAND")
+    parser.add_argument('--random', type=int, metavar='N',
+                        help="random search con N prove invece della griglia completa")
+    parser.add_argument('--eval-hands', type=int, default=200000, help="mani di valutazione per prova")
+    parser.add_argument('--eval-seed', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0, help="seed dei training e della random search")
+    parser.add_argument('--workers', type=int, help="processi paralleli (default: tutti i core)")
+    parser.add_argument('--checkpoint', metavar='FILE', default='sweep.jsonl',
+                        help="file delle prove completate, per riprendere una ricerca interrotta")
+    parser.add_argument('--table', metavar='FILE', help="salva la classifica in CSV")
+    parser.add_argument('--top', type=int, default=20, help="righe della classifica da stampare")
+    args = parser.parse_args(argv)
+
+    space = {'agent': args.agent}
+    for name in PARAMETERS:
+        space[name] = parse_values(getattr(args, name), float)
+    space['episodes'] = args.episodes
+    if args.counting:
+        # Solo se richiesto: gli identificativi delle prove senza counting non cambiano
+        space['counting'] = [True]
+    if args.full_actions:
+        space['full_actions'] = [True]
+    if args.random:
+        configs = random_search(space, args.random, args.seed)
+    else:
+        ranges = [name for name, values in space.items() if isinstance(values, tuple)]
+        if ranges:
+            parser.error(f"gli intervalli MIN:MAX richiedono --random ({', '.join(ranges)})")
+        configs = grid(space)
+
+    rows = sweep(configs, eval_hands=args.eval_hands, eval_seed=args.eval_seed, seed=args.seed,
+                 num_workers=args.workers, checkpoint=args.checkpoint)
+    print_table(rows, args.top)
+    if args.table:
+        write_table(rows, args.table)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,432 @@
+"""
+Soft17 - Dataset preprocessato
+Abbatiello Simone
+Nappi Vincenzo
+Niemiec Francesco
+
+Lettura e parsing di blackjack_simulator.csv condivisi dai notebook
+(exploration, first, second, offline_q_learning). Alla prima esecuzione il CSV
+viene letto a blocchi e le feature vengono salvate in colonne tipizzate
+(un file .npy per colonna) nella cartella cache/dataset; dalle esecuzioni
+successive le colonne vengono solo mappate in memoria:
+
+    from soft17_dataset import load_dataset
+    dataset = load_dataset("blackjack_simulator.csv")
+
+Oltre alle feature per riga, load_transitions restituisce le transizioni
+(HIT, STAND, raddoppio, resa) ricostruite passo per passo da ogni mano, per il
+Q-learning offline.
+
+La cache è indicizzata dall'hash del contenuto del CSV: se il file cambia
+viene ricostruita, se viene solo copiato o toccato no.
+"""
+
+import ast
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+INPUT_CSV = "blackjack_simulator.csv"
+CACHE_PATH = os.path.join("cache", "dataset")
+CHUNK_ROWS = 200_000
+# Da incrementare quando cambia il parsing, per invalidare le cache esistenti
+FORMAT_VERSION = 4
+
+# Colonne della cache: action è il codice di ACTIONS dell'ultima azione, -1 se
+# non è valida; reward è il segno di win (-1 anche quando win manca).
+# Le colonne legacy_* sono player_sum e player_is_soft come li calcolavano le
+# pipeline first e second, che le usano per replicarne i risultati
+COLUMNS = {
+    "player_sum": np.int16,
+    "player_is_soft": np.int8,
+    "legacy_player_sum": np.int16,
+    "legacy_player_is_soft": np.int8,
+    "player_pair": np.int8,
+    "dealer_up": np.int16,
+    "action": np.int8,
+    "reward": np.int8,
+    "win": np.float32,
+}
+# Transizioni ricostruite passo per passo dalle mani (cartella transitions della
+# cache): reward è 0 tranne che sull'ultima azione (done = 1), dove vale il segno
+# di win dopo HIT/STAND e win stesso dopo raddoppio e resa, in cui conta la puntata
+TRANSITION_COLUMNS = {
+    "player_sum": np.int16,
+    "player_is_soft": np.int8,
+    "dealer_up": np.int16,
+    "action": np.int8,
+    "reward": np.float32,
+    "next_sum": np.int16,
+    "next_is_soft": np.int8,
+    "done": np.int8,
+}
+SOURCE_COLUMNS = ["initial_hand", "dealer_up", "actions_taken", "player_final", "win"]
+# Azioni del dataset, con gli stessi codici di BlackjackEnv nelle demo: S = STAND,
+# H = HIT, D = raddoppio, P = split, R = resa. N (assicurazione rifiutata) non è
+# una decisione di gioco e viene ignorata
+ACTIONS = {"S": 0, "H": 1, "D": 2, "P": 3, "R": 4}
+
+
+class RepairedCSV:
+    """Il CSV letto a blocchi: se a fine file le virgolette sono dispari
+    (stringa non chiusa) aggiunge '"\\n', senza scrivere una copia riparata."""
+
+    def __init__(self, path):
+        self.f = open(path, "r", encoding="utf-8", errors="ignore")
+        self.quote_count = 0
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.quote_count += data.count('"')
+        if not data and self.quote_count % 2 != 0:
+            print("⚠️ CSV invalido: stringa non chiusa a fine file → chiusura forzata")
+            self.quote_count += 1
+            return '"\n'
+        return data
+
+    # read_csv riconosce un file solo se ha anche __iter__, ma legge sempre con read
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        raise StopIteration
+
+    def close(self):
+        self.f.close()
+
+
+# PARSING
+
+def parse_list(x):
+    if isinstance(x, list):
+        return x
+    if not isinstance(x, str):
+        return []
+    try:
+        return json.loads(x)
+    except:
+        try:
+            return ast.literal_eval(x)
+        except:
+            return []
+
+
+def card_value(card):
+    if isinstance(card, (int, float, np.number)):
+        return int(card) if np.isfinite(card) else 0
+    c = str(card).strip().upper()
+    if c in {"J", "Q", "K"}:
+        return 10
+    if c == "A":
+        return 11
+    try:
+        return int(c)
+    except:
+        return 0
+
+
+def hand_value(values):
+    """(valore, soft) di una mano; soft = c'è un asso contato 11"""
+    total = sum(values)
+    aces = values.count(11)
+    while total > 21 and aces > 0:
+        total -= 10
+        aces -= 1
+    return total, int(aces > 0)
+
+
+def hand_features(x):
+    """(valore, soft, coppia, valore legacy, soft legacy) della mano iniziale"""
+    hand = parse_list(x)
+    if not isinstance(hand, list):
+        return 0, 0, 0, 0, 0
+    values = [card_value(c) for c in hand]
+    pair = int(len(values) == 2 and values[0] == values[1])
+    # Come in first e second: possono scendere a 1 solo gli assi scritti "A" (non
+    # un 11 numerico), e la mano è soft se almeno uno è sceso
+    aces = sum(str(c).strip().upper() == "A" for c in hand)
+    total, reduced = sum(values), 0
+    while total > 21 and reduced < aces:
+        total -= 10
+        reduced += 1
+    return (*hand_value(values), pair, total, int(reduced > 0))
+
+
+def single_hand(x):
+    """La lista di x se riguarda una sola mano: nel dataset actions_taken e
+    player_final hanno una lista per mano ([['H', 'S']]), più di una dopo uno split"""
+    items = parse_list(x)
+    if not isinstance(items, list):
+        return None
+    if items and all(isinstance(item, list) for item in items):
+        return items[0] if len(items) == 1 else None
+    return items
+
+
+def hand_actions(x):
+    acts = single_hand(x)
+    return None if acts is None else [act for act in acts if act != "N"]
+
+
+def extract_action(x):
+    """Codice (ACTIONS) dell'ultima azione della mano, -1 se mancante o sconosciuta"""
+    acts = hand_actions(x)
+    if not acts:
+        return -1
+    return ACTIONS.get(acts[-1], -1) if isinstance(acts[-1], str) else -1
+
+
+def hand_steps(initial, actions, final):
+    """Transizioni (somma, soft, azione, somma dopo, soft dopo, done) di una mano.
+
+    Le carte pescate con HIT e raddoppio sono quelle in coda a player_final.
+    Raddoppio e resa sono ammessi solo come prima e unica decisione; mani con
+    split (più mani nella stessa riga), azioni sconosciute o non coerenti con
+    le carte non danno transizioni.
+    """
+    hand = parse_list(initial)
+    acts = hand_actions(actions)
+    cards = single_hand(final)
+    if not isinstance(hand, list) or not hand or not acts or cards is None:
+        return []
+    if not all(isinstance(act, str) and act in ACTIONS and act != "P" for act in acts):
+        return []
+    values = [card_value(c) for c in cards]
+    drawn_cards = acts.count("H") + acts.count("D")
+    if len(values) != len(hand) + drawn_cards or values[:len(hand)] != [card_value(c) for c in hand]:
+        return []
+
+    steps = []
+    drawn = len(hand)
+    state = hand_value(values[:drawn])
+    for i, act in enumerate(acts):
+        if state[0] > 21 or (act != "H" and i < len(acts) - 1):
+            return []
+        if act in ("D", "R") and i > 0:
+            return []
+        if act in ("H", "D"):
+            drawn += 1
+        next_state = hand_value(values[:drawn])
+        steps.append((*state, ACTIONS[act], *next_state, int(i == len(acts) - 1)))
+        state = next_state
+    return steps
+
+
+# Nel dataset le celle distinte di initial_hand, dealer_up e actions_taken sono
+# poche (migliaia su milioni di righe): ogni blocco viene fattorizzato con
+# pd.factorize, le funzioni qui sopra girano una volta per valore distinto e il
+# risultato torna sulle righe con un'indicizzazione NumPy.
+
+def by_unique(column, func, missing):
+    codes, uniques = pd.factorize(column)
+    # L'ultima riga serve alle celle vuote (NaN), che factorize codifica con -1
+    table = np.array([func(x) for x in uniques] + [missing], dtype=np.int64)
+    return table[codes]
+
+
+def chunk_features(chunk):
+    hands = by_unique(chunk["initial_hand"], hand_features, (0, 0, 0, 0, 0))
+    win = chunk["win"].to_numpy(dtype=np.float64)
+    features = {
+        "player_sum": hands[:, 0],
+        "player_is_soft": hands[:, 1],
+        "player_pair": hands[:, 2],
+        "legacy_player_sum": hands[:, 3],
+        "legacy_player_is_soft": hands[:, 4],
+        "dealer_up": by_unique(chunk["dealer_up"], card_value, 0),
+        "action": by_unique(chunk["actions_taken"], extract_action, -1),
+        "reward": np.where(win > 0, 1, np.where(win == 0, 0, -1)),
+        "win": win,
+    }
+    return {name: features[name].astype(dtype) for name, dtype in COLUMNS.items()}
+
+
+def chunk_transitions(chunk, features):
+    """Transizioni delle righe di chunk, nell'ordine delle righe"""
+    # Ogni colonna viene fattorizzata e analizzata una volta per valore
+    # distinto; le combinazioni (mano iniziale, azioni, carte finali) sono
+    # codificate in un solo intero e fattorizzate a loro volta
+    key = np.zeros(len(chunk), dtype=np.int64)
+    parsed = []
+    for name in ("initial_hand", "actions_taken", "player_final"):
+        codes, uniques = pd.factorize(chunk[name])
+        values = [parse_list(x) for x in uniques] + [[]]
+        # Le celle vuote (codice -1) vanno sull'ultimo valore, la lista vuota
+        key = key * len(values) + codes % len(values)
+        parsed.append(values)
+    codes, uniques = pd.factorize(key)
+    steps = []
+    for combination in uniques:
+        combination, final = divmod(int(combination), len(parsed[2]))
+        hand, actions = divmod(combination, len(parsed[1]))
+        steps.append(hand_steps(parsed[0][hand], parsed[1][actions], parsed[2][final]))
+    table = np.array([step for hand in steps for step in hand], dtype=np.int64).reshape(-1, 6)
+    lengths = np.array([len(hand) for hand in steps], dtype=np.int64)
+    offsets = np.cumsum(lengths) - lengths
+
+    # Indici ragged: per ogni riga i suoi lengths[code] passi consecutivi in table
+    row_lengths = lengths[codes]
+    rows = np.repeat(np.arange(len(codes)), row_lengths)
+    within = np.arange(len(rows)) - np.repeat(np.cumsum(row_lengths) - row_lengths, row_lengths)
+    table = table[np.repeat(offsets[codes], row_lengths) + within]
+
+    done = table[:, 5]
+    # Dopo raddoppio e resa il reward è la vincita effettiva (puntata doppia, mezza puntata)
+    win = features["win"][rows]
+    final_reward = np.where((table[:, 2] >= ACTIONS["D"]) & ~np.isnan(win), win, features["reward"][rows])
+    transitions = {
+        "player_sum": table[:, 0],
+        "player_is_soft": table[:, 1],
+        "dealer_up": features["dealer_up"][rows],
+        "action": table[:, 2],
+        "reward": np.where(done == 1, final_reward, 0),
+        "next_sum": table[:, 3],
+        "next_is_soft": table[:, 4],
+        "done": done,
+    }
+    return {name: transitions[name].astype(dtype) for name, dtype in TRANSITION_COLUMNS.items()}
+
+
+# CACHE
+
+def file_digest(path, cache_dir=CACHE_PATH):
+    """Hash del contenuto di path, ricalcolato solo se dimensione o mtime cambiano"""
+    stat = os.stat(path)
+    index_path = os.path.join(cache_dir, "index.json")
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+    key = os.path.abspath(path)
+    entry = index.get(key)
+    if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+        return entry["digest"]
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    index[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                  "digest": digest.hexdigest()}
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{index_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, index_path)
+    return index[key]["digest"]
+
+
+def write_npy(path, part_path, dtype):
+    """Converte in .npy i valori grezzi di part_path (scritti con tofile), copiandoli a blocchi"""
+    dtype = np.dtype(dtype)
+    length = os.path.getsize(part_path) // dtype.itemsize
+    with open(path, "wb") as f:
+        np.lib.format.write_array_header_1_0(f, {"descr": np.lib.format.dtype_to_descr(dtype),
+                                                 "fortran_order": False, "shape": (length,)})
+        with open(part_path, "rb") as part:
+            shutil.copyfileobj(part, f)
+    os.remove(part_path)
+    return length
+
+
+def build_cache(path, directory, chunk_rows=CHUNK_ROWS):
+    """Legge il CSV a blocchi e salva una colonna .npy per feature più meta.json.
+
+    I valori di ogni blocco vengono accodati subito su disco (un file grezzo per
+    colonna, convertito in .npy alla fine): la memoria usata dipende da
+    chunk_rows e non dalla dimensione del CSV.
+    """
+    # Scrittura in una cartella temporanea e poi rename: una cache interrotta
+    # a metà non viene mai letta
+    tmp_dir = f"{directory}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(os.path.join(tmp_dir, "transitions"))
+    outputs = [("", COLUMNS), ("transitions", TRANSITION_COLUMNS)]
+    parts = {(folder, name): open(os.path.join(tmp_dir, folder, f"{name}.npy.part"), "wb")
+             for folder, columns in outputs for name in columns}
+    null_counts = {}
+    rows = 0
+    source = RepairedCSV(path)
+    try:
+        for chunk in tqdm(pd.read_csv(source, chunksize=chunk_rows), desc="Preprocessing CSV"):
+            rows += len(chunk)
+            for column, n in chunk.isna().sum().items():
+                null_counts[column] = null_counts.get(column, 0) + int(n)
+            # Le colonne mancanti nel CSV restano vuote (NaN)
+            chunk = chunk.reindex(columns=SOURCE_COLUMNS)
+            features = chunk_features(chunk)
+            for name, values in features.items():
+                values.tofile(parts["", name])
+            for name, values in chunk_transitions(chunk, features).items():
+                values.tofile(parts["transitions", name])
+    finally:
+        source.close()
+        for part in parts.values():
+            part.close()
+
+    lengths = {}
+    for folder, columns in outputs:
+        for name, dtype in columns.items():
+            column_path = os.path.join(tmp_dir, folder, f"{name}.npy")
+            lengths[folder, name] = write_npy(column_path, f"{column_path}.part", dtype)
+    meta = {
+        "source": os.path.basename(path),
+        "rows": rows,
+        "transitions": lengths["transitions", "done"],
+        "null_counts": null_counts,
+        "format_version": FORMAT_VERSION,
+    }
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+
+
+def cache_directory(path=INPUT_CSV, cache_dir=CACHE_PATH, chunk_rows=CHUNK_ROWS, rebuild=False):
+    """Cartella con le colonne preprocessate di path, costruita se manca"""
+    digest = file_digest(path, cache_dir)
+    directory = os.path.join(cache_dir, f"{digest}_v{FORMAT_VERSION}")
+    if rebuild or not os.path.exists(os.path.join(directory, "meta.json")):
+        build_cache(path, directory, chunk_rows)
+    return directory
+
+
+def load_columns(path=INPUT_CSV, cache_dir=CACHE_PATH, columns=None, rebuild=False):
+    """Colonne della cache come array NumPy mappati in memoria (sola lettura)"""
+    directory = cache_directory(path, cache_dir, rebuild=rebuild)
+    return {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            for name in (columns or COLUMNS)}
+
+
+def load_dataset(path=INPUT_CSV, cache_dir=CACHE_PATH, columns=None, rebuild=False):
+    """Feature di tutte le righe del CSV in un DataFrame.
+
+    Le colonne restano mappate in memoria (sola lettura): si possono sostituire
+    o aggiungere colonne, ma non modificarne i valori sul posto. In
+    dataset.attrs ci sono le informazioni sul file originale: numero di righe e
+    valori nulli per colonna (tutte le colonne del CSV).
+    """
+    directory = cache_directory(path, cache_dir, rebuild=rebuild)
+    # copy=False: senza, pandas copierebbe gli array mappati in memoria
+    dataset = pd.DataFrame({name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+                            for name in (columns or COLUMNS)}, copy=False)
+    with open(os.path.join(directory, "meta.json")) as f:
+        dataset.attrs.update(json.load(f))
+    return dataset
+
+
+def load_transitions(path=INPUT_CSV, cache_dir=CACHE_PATH, rebuild=False):
+    """Transizioni di tutte le mani del CSV in un DataFrame (vedi hand_steps)"""
+    directory = cache_directory(path, cache_dir, rebuild=rebuild)
+    transitions = pd.DataFrame({name: np.load(os.path.join(directory, "transitions", f"{name}.npy"),
+                                              mmap_mode="r")
+                                for name in TRANSITION_COLUMNS}, copy=False)
+    with open(os.path.join(directory, "meta.json")) as f:
+        transitions.attrs.update(json.load(f))
+    return transitions